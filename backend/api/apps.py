@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Регистрация обработчиков сигналов
+        from . import cache  # noqa: F401
+        from .manage import functionality  # noqa: F401
@@ -0,0 +1,107 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import QuerySet
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from rest_framework import response
+
+# Безопасные методы, которые могут обслуживаться асинхронно
+ASYNC_METHODS = ('GET', 'HEAD')
+
+
+class AsyncReadMixin:
+    """Асинхронные GET-обработчики ViewSet для работы под ASGI.
+
+    При ASYNC_READ_VIEWS as_view() возвращает корутину: GET и HEAD
+    действий из async_actions выполняются обработчиком a<действие>
+    в event loop (async ORM и асинхронный кэш), остальные запросы
+    уходят в обычный синхронный view в отдельном потоке. Сериализатор
+    работает в event loop, поэтому не должен сам ходить в базу.
+    """
+
+    async_actions = ('list', 'retrieve')
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):  # noqa: N805
+        view = super().as_view(actions, **initkwargs)
+        if not settings.ASYNC_READ_VIEWS:
+            return view
+        sync_view = sync_to_async(view)
+        if 'get' in actions and 'head' not in actions:
+            actions = {**actions, 'head': actions['get']}
+
+        async def async_view(request, *args, **kwargs):
+            action = actions.get(request.method.lower())
+            if request.method not in ASYNC_METHODS or (
+                action not in cls.async_actions
+            ):
+                return await sync_view(request, *args, **kwargs)
+            self = cls(**initkwargs)
+            self.action_map = actions
+            for method, name in actions.items():
+                setattr(self, method, getattr(self, name))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+            return await self.adispatch(
+                getattr(self, f'a{action}'), request, *args, **kwargs
+            )
+
+        async_view.__dict__.update(view.__dict__)
+        return async_view
+
+    async def adispatch(self, handler, request, *args, **kwargs):
+        """APIView.dispatch() с асинхронным обработчиком.
+            Аутентификация и проверка прав - в потоке: ключ токена
+            может искаться в базе синхронными классами DRF.
+        """
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            result = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            result = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, result, *args, **kwargs
+        )
+        return self.response
+
+    async def afilter_queryset(self):
+        """filter_queryset() в потоке: фильтры могут проверять
+            значения запросами к базе (ModelChoiceFilter).
+        """
+
+        return await sync_to_async(self.filter_queryset)(self.get_queryset())
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset()
+        if self.paginator is None:
+            if isinstance(queryset, QuerySet):
+                queryset = [obj async for obj in queryset]
+            return response.Response(
+                self.get_serializer(queryset, many=True).data
+            )
+        # COUNT и страница с prefetch - за один переход в поток
+        page = await sync_to_async(self.paginate_queryset)(queryset)
+        return self.get_paginated_response(
+            self.get_serializer(page, many=True).data
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        queryset = await self.afilter_queryset()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        except (queryset.model.DoesNotExist, TypeError, ValueError,
+                ValidationError):
+            raise Http404
+        self.check_object_permissions(request, instance)
+        return response.Response(self.get_serializer(instance).data)
@@ -0,0 +1,124 @@
+from hashlib import sha256
+from hmac import compare_digest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .cache import token_user_key
+from user.models import User
+
+# Поля пользователя, которые access-токен несёт в себе
+USER_CLAIMS = (
+    'email', 'username', 'first_name', 'last_name',
+    'is_active', 'is_staff', 'is_superuser',
+)
+# Поле токенов с хэшем ключа authtoken, выданного при входе
+AUTH_TOKEN_CLAIM = 'auth_token'
+
+
+def auth_token_hash(key):
+    return sha256(key.encode()).hexdigest()
+
+
+def refresh_token_for(auth_token):
+    """Refresh-токен, привязанный к ключу authtoken."""
+
+    token = RefreshToken.for_user(auth_token.user)
+    token[AUTH_TOKEN_CLAIM] = auth_token_hash(auth_token.key)
+    return token
+
+
+def access_token_for(auth_token):
+    """Подписанный access-токен с полями USER_CLAIMS,
+        привязанный к ключу authtoken.
+    """
+
+    user = auth_token.user
+    token = AccessToken.for_user(user)
+    for field in USER_CLAIMS:
+        token[field] = getattr(user, field)
+    token[AUTH_TOKEN_CLAIM] = auth_token_hash(auth_token.key)
+    return token
+
+
+def issuing_token(token):
+    """Ключ authtoken, по которому выдан JWT, вместе с пользователем.
+        None, если ключ удалён выходом (или заменён новым входом).
+    """
+
+    auth_token = Token.objects.select_related('user').filter(
+        user_id=token.get(api_settings.USER_ID_CLAIM)
+    ).first()
+    if auth_token is None or not compare_digest(
+        auth_token_hash(auth_token.key), str(token.get(AUTH_TOKEN_CLAIM))
+    ):
+        return None
+    return auth_token
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """Заголовок Authorization: Token <ключ>.
+
+    При STATELESS_AUTH ключом может быть access-токен JWT: он проверяется
+    по подписи и сроку, пользователь собирается из его полей без запроса
+    к базе, остальные поля модели дочитываются при обращении. Ключ
+    authtoken ищется в базе один раз, пользователь по нему кэшируется на
+    AUTH_TOKEN_CACHE_TIMEOUT секунд. Для изменяющих запросов пользователь
+    всегда читается из базы: сохранение не должно записать поверх свежих
+    данных устаревшие поля из токена или кэша. Access-токен при этом
+    принимается, только пока жив ключ authtoken, по которому он выдан:
+    после выхода он годится лишь для чтения до конца своего срока.
+    """
+
+    def authenticate(self, request):
+        self.safe = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        if settings.STATELESS_AUTH and key.count('.') == 2:
+            return self.authenticate_signed(key)
+        if not self.safe:
+            return super().authenticate_credentials(key)
+        cache_key = token_user_key(key)
+        user = cache.get(cache_key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, user, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+            return user, token
+        return user, Token(key=key, user=user)
+
+    def authenticate_signed(self, key):
+        try:
+            token = AccessToken(key)
+        except TokenError:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        claims = {'id': token.get(api_settings.USER_ID_CLAIM)}
+        if self.safe and all(field in token for field in USER_CLAIMS):
+            claims.update((field, token[field]) for field in USER_CLAIMS)
+            fields = [
+                field.attname for field in User._meta.concrete_fields
+                if field.attname in claims
+            ]
+            user = User.from_db(
+                router.db_for_write(User),
+                fields,
+                [claims[field] for field in fields],
+            )
+        else:
+            auth_token = issuing_token(token)
+            if auth_token is None:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user = auth_token.user
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, token
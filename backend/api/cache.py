@@ -0,0 +1,441 @@
+from hashlib import md5, sha256
+from time import time_ns
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from rest_framework import response
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from .replica import read_from_primary
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           ShoppingCart, ShoppingCartTotal, Tag, bulk_changed)
+from user.models import AUTHOR_FIELDS, Subscription, User
+
+# Версия общей ленты рецептов: всё, что видно в карточке рецепта
+RECIPE_FEED = 'recipe_feed'
+# Версия рейтингов (refresh_recipe_scores): от неё зависят только
+# страницы ленты с ?ordering=popular|trending
+RECIPE_SCORES = 'recipe_scores'
+
+
+def version_key(name):
+    """Ключ счётчика версий в кэше."""
+
+    return f'version:{name}'
+
+
+def new_version():
+    """Начальная версия: время в наносекундах.
+
+    Кэш может вытеснить счётчик версии раньше данных, закэшированных
+    под ним. Новый счётчик начинается не с 1, а с числа, которое ещё
+    не выдавалось, поэтому записи прежних версий не оживают.
+    """
+
+    return time_ns()
+
+
+def get_version(name):
+    """Текущая версия данных, общая для всех воркеров."""
+
+    return cache.get_or_set(version_key(name), new_version, timeout=None)
+
+
+async def aget_version(name):
+    """get_version() для асинхронных обработчиков."""
+
+    return await cache.aget_or_set(
+        version_key(name), new_version, timeout=None
+    )
+
+
+def bump_version(*names):
+    """Сдвигает версии: все кэши, завязанные на них, устаревают.
+        Сдвиг происходит после коммита транзакции, чтобы новая версия
+        не закэшировала ещё не видимые данные.
+    """
+
+    def bump():
+        for name in names:
+            key = version_key(name)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, new_version(), timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def get_model_version(model):
+    """Текущая версия данных модели."""
+
+    return get_version(model._meta.label_lower)
+
+
+async def aget_model_version(model):
+    """get_model_version() для асинхронных обработчиков."""
+
+    return await aget_version(model._meta.label_lower)
+
+
+def bump_model_version(model):
+    """Сдвигает версию данных модели."""
+
+    bump_version(model._meta.label_lower)
+
+
+def user_flags_version(user_id):
+    """Имя версии персональных флагов пользователя."""
+
+    return f'user_flags:{user_id}'
+
+
+def shopping_cart_totals_version(user_id):
+    """Имя версии итогов <списка покупок> пользователя."""
+
+    return f'shopping_cart_totals:{user_id}'
+
+
+def get_user_flags(user):
+    """id рецептов в <избранном>, <списке покупок> и id авторов
+        в <подписках> пользователя. Кэшируются до их изменения.
+    """
+
+    key = (
+        f'recipe_flags:{user.id}:'
+        f'{get_version(user_flags_version(user.id))}'
+    )
+    flags = cache.get(key)
+    if flags is None:
+        with read_from_primary():
+            flags = {
+                'is_favorited': set(Favorite.objects.filter(
+                    user=user
+                ).values_list('recipe_id', flat=True)),
+                'is_in_shopping_cart': set(ShoppingCart.objects.filter(
+                    user=user
+                ).values_list('recipe_id', flat=True)),
+                'is_subscribed': set(Subscription.objects.filter(
+                    user=user
+                ).values_list('author_id', flat=True)),
+            }
+        cache.set(key, flags, settings.API_CACHE_TIMEOUT)
+    return flags
+
+
+def token_user_key(key):
+    """Ключ пользователя по ключу authtoken; сам ключ в кэш не попадает."""
+
+    return f'token_user:{sha256(key.encode()).hexdigest()}'
+
+
+def forget_token_users(keys):
+    """Удаляет пользователей по ключам authtoken из кэша после коммита."""
+
+    keys = [token_user_key(key) for key in keys]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_tag_ids():
+    """{slug: id} всех тегов. Кэшируется до изменения тегов."""
+
+    key = f'tag_ids:{get_model_version(Tag)}'
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        with read_from_primary():
+            tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.API_CACHE_TIMEOUT)
+    return tag_ids
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(bulk_changed, sender=Ingredient)
+def reference_changed(sender, **kwargs):
+    """Сбрасывает кэши справочника и ленты при изменении справочника."""
+
+    bump_model_version(sender)
+    bump_version(RECIPE_FEED)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_changed(sender, **kwargs):
+    """Сбрасывает общую ленту при изменении рецептов."""
+
+    bump_version(RECIPE_FEED)
+
+
+def has_recipes(user):
+    return Recipe.objects.filter(author_id=user.pk).exists()
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Сбрасывает общую ленту при изменении полей автора (AUTHOR_FIELDS).
+        Новый пользователь, сохранение других полей (last_login при
+        входе, пароль) и пользователь без рецептов ленту не трогают.
+    """
+
+    changed = getattr(instance, 'loaded_author', None) != (
+        instance.author_values()
+    )
+    instance.loaded_author = instance.author_values()
+    if created or not changed:
+        return
+    if update_fields is not None and not set(update_fields) & set(
+        AUTHOR_FIELDS
+    ):
+        return
+    if has_recipes(instance):
+        bump_version(RECIPE_FEED)
+
+
+@receiver(pre_delete, sender=User)
+def author_deleting(sender, instance, **kwargs):
+    """Рецепты автора остаются в ленте без автора (SET_NULL)."""
+
+    instance.had_recipes = has_recipes(instance)
+
+
+@receiver(post_delete, sender=User)
+def author_deleted(sender, instance, **kwargs):
+    if getattr(instance, 'had_recipes', True):
+        bump_version(RECIPE_FEED)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def user_flags_changed(sender, instance, **kwargs):
+    """Сбрасывает только персональные флаги пользователя."""
+
+    bump_version(user_flags_version(instance.user_id))
+
+
+@receiver(bulk_changed, sender=ShoppingCartTotal)
+def shopping_cart_totals_changed(sender, user_ids, **kwargs):
+    """Сдвигает версии итогов <списков покупок> пользователей."""
+
+    bump_version(*map(shopping_cart_totals_version, user_ids))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """После выхода ключ не находит пользователя и в кэше."""
+
+    forget_token_users([instance.key])
+
+
+@receiver(post_save, sender=User)
+def token_user_changed(sender, instance, update_fields=None, **kwargs):
+    """Пользователь в кэше ключей перечитывается после изменения.
+        Обновление одного last_login при входе кэш не трогает.
+    """
+
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        forget_token_users(
+            Token.objects.filter(user=instance).values_list('key', flat=True)
+        )
+
+
+class VersionedCacheMixin:
+    """Кэш готового JSON для read-only ViewSet справочников.
+
+    Ключ - версия модели cache_model и полный путь запроса, ETag
+    строится из него же, поэтому повторный запрос с If-None-Match
+    получает 304 без обращения к базе.
+    """
+
+    cache_model = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().list, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve, *args, **kwargs
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(
+            request, super().alist, *args, **kwargs
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(
+            request, super().aretrieve, *args, **kwargs
+        )
+
+    def response_cache_key(self, request):
+        return (
+            f'response:{self.cache_model._meta.label_lower}:'
+            f'{self.model_version}:{request.get_full_path()}'
+        )
+
+    def cached_response(self, request, build, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return build(request, *args, **kwargs)
+        self.model_version = get_model_version(self.cache_model)
+        key = self.response_cache_key(request)
+        if self.is_not_modified(request, key):
+            return self.content_response(None, key)
+        content = cache.get(key)
+        if content is None:
+            with read_from_primary():
+                response = build(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content, settings.API_CACHE_TIMEOUT)
+        return self.content_response(content, key)
+
+    async def acached_response(self, request, build, *args, **kwargs):
+        """cached_response() для асинхронных обработчиков."""
+
+        if request.accepted_renderer.format != 'json':
+            return await build(request, *args, **kwargs)
+        self.model_version = await aget_model_version(self.cache_model)
+        key = self.response_cache_key(request)
+        if self.is_not_modified(request, key):
+            return self.content_response(None, key)
+        content = await cache.aget(key)
+        if content is None:
+            with read_from_primary():
+                response = await build(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            await cache.aset(key, content, settings.API_CACHE_TIMEOUT)
+        return self.content_response(content, key)
+
+    def get_etag(self, key):
+        return f'"{md5(key.encode()).hexdigest()}"'
+
+    def is_not_modified(self, request, key):
+        return self.get_etag(key) in request.headers.get('If-None-Match', '')
+
+    def content_response(self, content, key):
+        """Ответ с готовым JSON, без content - 304 Not Modified."""
+
+        if content is None:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = self.get_etag(key)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class FeedCacheMixin:
+    """Двухуровневый кэш ленты рецептов.
+
+    Страница ленты кэшируется одна на все запросы с теми же фильтрами,
+    с флагами как у анонима. Флаги пользователя (get_user_flags) хранятся
+    отдельно и накладываются на страницу при ответе. Фильтры по
+    <избранному> и <списку покупок> зависят от пользователя и идут мимо
+    кэша.
+    """
+
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+    score_orderings = ('popular', 'trending')
+    shared_feed = False
+
+    def get_count_cache_prefix(self):
+        """Версия данных, от которой зависит количество рецептов."""
+
+        user = self.request.user
+        prefix = f'{RECIPE_FEED}:{get_version(RECIPE_FEED)}'
+        if user.is_authenticated:
+            prefix += f':{get_version(user_flags_version(user.id))}'
+        return prefix
+
+    def is_personal(self, request):
+        """Запрос с фильтрами по данным пользователя идёт мимо кэша."""
+
+        return request.user.is_authenticated and any(
+            name in request.query_params for name in self.user_filters
+        )
+
+    def feed_versions(self, request):
+        """Версии, от которых зависит страница: сортировка по рейтингу
+            добавляет версию рейтингов.
+        """
+
+        if request.query_params.get('ordering') in self.score_orderings:
+            return (RECIPE_FEED, RECIPE_SCORES)
+        return (RECIPE_FEED,)
+
+    def feed_cache_key(self, request, versions):
+        return (
+            f'recipe_feed:{":".join(map(str, versions))}:'
+            f'{request.get_host()}{request.get_full_path()}'
+        )
+
+    def list(self, request, *args, **kwargs):
+        user = request.user
+        if self.is_personal(request):
+            return super().list(request, *args, **kwargs)
+        key = self.feed_cache_key(request, [
+            get_version(name) for name in self.feed_versions(request)
+        ])
+        data = cache.get(key)
+        if data is None:
+            self.shared_feed = True
+            with read_from_primary():
+                data = super().list(request, *args, **kwargs).data
+            cache.set(key, data, settings.API_CACHE_TIMEOUT)
+        if user.is_authenticated:
+            self.apply_user_flags(data, get_user_flags(user))
+        return response.Response(data)
+
+    async def alist(self, request, *args, **kwargs):
+        """list() для асинхронных обработчиков."""
+
+        user = request.user
+        if self.is_personal(request):
+            return await super().alist(request, *args, **kwargs)
+        key = self.feed_cache_key(request, [
+            await aget_version(name) for name in self.feed_versions(request)
+        ])
+        data = await cache.aget(key)
+        if data is None:
+            self.shared_feed = True
+            with read_from_primary():
+                data = (await super().alist(request, *args, **kwargs)).data
+            await cache.aset(key, data, settings.API_CACHE_TIMEOUT)
+        if user.is_authenticated:
+            self.apply_user_flags(
+                data, await sync_to_async(get_user_flags)(user)
+            )
+        return response.Response(data)
+
+    def apply_user_flags(self, data, flags):
+        recipes = data['results'] if isinstance(data, dict) else data
+        for recipe in recipes:
+            recipe['is_favorited'] = recipe['id'] in flags['is_favorited']
+            recipe['is_in_shopping_cart'] = (
+                recipe['id'] in flags['is_in_shopping_cart']
+            )
+            if recipe['author'] is not None:
+                recipe['author']['is_subscribed'] = (
+                    recipe['author']['id'] in flags['is_subscribed']
+                )
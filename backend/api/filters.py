@@ -1,9 +1,13 @@
-from itertools import chain
 from urllib.parse import unquote
 
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
 from django_filters.rest_framework import FilterSet, filters
 from rest_framework.filters import SearchFilter
 
+from .cache import get_tag_ids
+from .search import ingredient_index
 from recipe.models import Recipe
 from user.models import User
 
@@ -11,11 +15,35 @@ from user.models import User
 class RecipeFilter(FilterSet):
     """Фильтр для рецептов."""
 
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(method='filter_tags')
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'), ('trending', 'trending')),
+        method='filter_ordering'
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tag_ids = get_tag_ids()
+        self.filters['tags'].extra['choices'] = [
+            (slug, slug) for slug in self.tag_ids
+        ]
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов. Слаги переводятся в id
+            по кэшу тегов, отбор - одним EXISTS: без JOIN по тегам
+            рецепты не дублируются и DISTINCT не нужен.
+        """
+
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe_id=OuterRef('pk'),
+                tag_id__in=[self.tag_ids[slug] for slug in value],
+            )
+        ))
 
     def filter_is_favorited(self, queryset, name, value):
         if value and not self.request.user.is_anonymous:
@@ -27,34 +55,73 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset
 
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по рейтингу из RecipeScore (refresh_recipe_scores).
+            score__isnull=False делает JOIN внутренним: страницу отдаёт
+            индекс рейтинга, без сортировки всех рецептов (LEFT JOIN на
+            миллионе рецептов - секунда на страницу). Строку рейтинга
+            каждому рецепту заводят сохранение рецепта, generate_dataset
+            и пересчёт рейтингов (create_missing), удалить её отдельно от
+            рецепта нельзя.
+        """
+
+        return queryset.filter(score__isnull=False).annotate(
+            score_value=F(f'score__{value}')
+        ).order_by('-score_value', '-id')
+
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+            'ordering',
+        )
 
 
 class IngredientFilter(SearchFilter):
-    """Фильтр для ингредиентов."""
+    """Фильтр для ингредиентов.
+        Совпадения по префиксу и вхождению отдаёт индекс в памяти
+        воркера. Если там ничего нет - один ранжированный запрос к базе,
+        где на PostgreSQL + pg_trgm находятся похожие по триграммам.
+    """
 
-    def filter_queryset(self, request, queryset, view):
+    search_param = 'name'
 
-        name_query_params = 'name'
-        value = request.query_params.get(name_query_params, None)
-        if value:
-            if value[0] == '%':
-                value = unquote(value)
-            else:
-                value = value.translate(
-                    str.maketrans(
-                        'qwertyuiop[]asdfghjkl;\'zxcvbnm,./',
-                        'йцукенгшщзхъфывапролджэячсмитьбю.'
-                    )
+    def get_search_terms(self, request):
+        value = request.query_params.get(self.search_param, None)
+        if not value:
+            return value
+        if value[0] == '%':
+            value = unquote(value)
+        else:
+            value = value.translate(
+                str.maketrans(
+                    'qwertyuiop[]asdfghjkl;\'zxcvbnm,./',
+                    'йцукенгшщзхъфывапролджэячсмитьбю.'
                 )
-            value = value.lower()
-            queryset_istartswith = queryset.filter(
-                name__istartswith=value
             )
-            queryset_contains = queryset.filter(
-                name__contains=value
-            ).difference(queryset_istartswith).order_by(name_query_params)
-            return list(chain(queryset_istartswith, queryset_contains))
-        return queryset
+        return value.lower()
+
+    def filter_queryset(self, request, queryset, view):
+        value = self.get_search_terms(request)
+        if not value:
+            return queryset
+        ingredients = ingredient_index.search(
+            value, getattr(view, 'model_version', None)
+        )
+        if ingredients:
+            return ingredients
+        matches = Q(name__icontains=value)
+        ordering = ('rank', 'name')
+        if connections[queryset.db].vendor == 'postgresql':
+            matches |= Q(name__trigram_similar=value)
+            queryset = queryset.annotate(
+                similarity=TrigramSimilarity('name', value)
+            )
+            ordering = ('rank', '-similarity', 'name')
+        return queryset.filter(matches).annotate(
+            rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                When(name__icontains=value, then=Value(1)),
+                default=Value(2),
+            )
+        ).order_by(*ordering)
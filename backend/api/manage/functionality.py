@@ -1,17 +1,32 @@
-from pathlib import Path
-from datetime import datetime as dt
+from hashlib import md5
+from itertools import islice
 
-from django.db.models.signals import post_delete
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.db.transaction import atomic
 from django.dispatch import receiver
-from django.shortcuts import HttpResponse
-from rest_framework import response, status
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import exceptions, response, status
 from rest_framework.generics import get_object_or_404
 
-from recipe.models import Recipe
+from ..cache import (get_model_version, get_version,
+                     shopping_cart_totals_version, user_flags_version)
+from .images import schedule_image_processing, schedule_release
+from recipe.models import (Favorite, Ingredient, Recipe, RecipeScore,
+                           ShoppingCart, ShoppingCartTotal)
+from user.models import Subscription, User
 
 
+@atomic
 def add_and_del(add_serializer, model, request, recipe_id):
-    """Опция добавления и удаления рецепта."""
+    """Опция добавления и удаления рецепта.
+        В одной транзакции с пересчётом итогов <списка покупок>.
+    """
 
     user = request.user
     data = {'user': user.id,
@@ -28,38 +43,198 @@ def add_and_del(add_serializer, model, request, recipe_id):
     return response.Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def get_recipes_limit(request):
+    """Параметр <recipes_limit> запроса, None если не передан."""
+
+    limit = request.query_params.get('recipes_limit')
+    if limit is None:
+        return None
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise exceptions.ValidationError(
+            {'recipes_limit': 'Ожидается тип данных integer'}
+        )
+    if limit < 0:
+        raise exceptions.ValidationError(
+            {'recipes_limit': 'не может быть меньше 0'}
+        )
+    return limit
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_cart_total(sender, instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в итоги <списка покупок>."""
+
+    if created:
+        ShoppingCartTotal.objects.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_cart_total(sender, instance, **kwargs):
+    """Убирает ингредиенты рецепта из итогов <списка покупок>.
+        pre_delete: при каскадном удалении рецепта его ингредиенты
+        ещё не удалены.
+    """
+
+    ShoppingCartTotal.objects.add_recipe(
+        instance.user_id, instance.recipe_id, sign=-1
+    )
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно сдвигает счётчик field записи pk на delta (не ниже 0)."""
+
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+@receiver(post_save, sender=Favorite)
+def increase_favorites_count(sender, instance, created, **kwargs):
+    """Рецепт добавлен в <избранное>."""
+
+    if created:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def decrease_favorites_count(sender, instance, **kwargs):
+    """Рецепт убран из <избранного>."""
+
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Subscription)
+def increase_subscribers_count(sender, instance, created, **kwargs):
+    """У автора новый подписчик."""
+
+    if created:
+        change_counter(User, instance.author_id, 'subscribers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def decrease_subscribers_count(sender, instance, **kwargs):
+    """От автора отписались."""
+
+    change_counter(User, instance.author_id, 'subscribers_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increase_recipes_count(sender, instance, created, **kwargs):
+    """У автора новый рецепт."""
+
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrease_recipes_count(sender, instance, **kwargs):
+    """У автора удалён рецепт."""
+
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    """Заводит нулевой рейтинг новому рецепту."""
+
+    if created:
+        RecipeScore.objects.create(recipe=instance, dirty=False)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def mark_recipe_score(sender, instance, **kwargs):
+    """Помечает рейтинг рецепта для пересчёта (refresh_recipe_scores)."""
+
+    RecipeScore.objects.filter(
+        pk=instance.recipe_id, dirty=False
+    ).update(dirty=True)
+
+
+@receiver(post_save, sender=Recipe)
+def process_image(sender, instance, **kwargs):
+    """Новая картинка рецепта уходит на обработку размеров."""
+
+    schedule_image_processing(instance)
+
+
 @receiver(post_delete, sender=Recipe)
 def delete_image(sender, instance, *a, **kw):
-    """Удаляет картинку при удаление рецепта."""
+    """Картинка и её размеры удаляются после коммита, если их
+        не использует другой рецепт.
+    """
 
-    image = Path(instance.image.path)
-    if image.exists():
-        image.unlink()
+    schedule_release(instance)
 
 
-def out_list_ingredients(self, request, ingredients):
-    """Загружает файл *.txt со списком покупок.
-        Доступно только авторизованным пользователям.
+def shopping_cart_ingredients(user):
+    """Строки <списка покупок> пользователя в порядке выгрузки."""
+
+    return ShoppingCartTotal.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+        amount=F('total_amount'),
+    ).order_by('name', 'measurement_unit')
+
+
+def shopping_cart_etag(request, *args, **kwargs):
+    """ETag файла: формат, дата выгрузки и версии в кэше, без запросов
+        к базе. Файл меняют <список покупок> (версия флагов), итоги
+        по ингредиентам (версия итогов) и справочник ингредиентов.
+    """
+
+    user_id = request.user.id
+    return md5(':'.join(str(value) for value in (
+        user_id,
+        request.accepted_renderer.format,
+        timezone.localdate(),
+        get_version(user_flags_version(user_id)),
+        get_version(shopping_cart_totals_version(user_id)),
+        get_model_version(Ingredient),
+    )).encode()).hexdigest()
+
+
+async def async_chunks(iterator, size):
+    """Синхронный генератор файла для ASGI: части читаются в потоке
+        пачками по size и отдаются из event loop. Синхронный итератор
+        ASGI-обработчик Django сначала целиком собрал бы в память.
     """
 
-    user = self.request.user
-    filename = f'{user.username}_shopping_list.txt'
+    read = sync_to_async(lambda: list(islice(iterator, size)))
+    while True:
+        pieces = await read()
+        if not pieces:
+            return
+        yield ''.join(pieces)
 
-    today = dt.today()
-    shopping_list = (
-        f'Список покупок для пользователя: {user.username}\n\n'
-        f'Дата: {today:%Y-%m-%d}\n\n'
+
+def out_list_ingredients(request, ingredients):
+    """Отдаёт файл со списком покупок в формате из <?format=>.
+        Строки читаются из базы частями и сразу уходят клиенту.
+        Доступно только авторизованным пользователям.
+    """
+
+    user = request.user
+    renderer = request.accepted_renderer
+    filename = f'{user.username}_shopping_list.{renderer.format}'
+    content = renderer.stream(
+        user=user,
+        date=timezone.localdate(),
+        ingredients=ingredients.iterator(
+            chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE
+        ),
     )
-    shopping_list += '\n'.join([
-        f'- {ingredient["ingredient__name"]} '
-        f'({ingredient["ingredient__measurement_unit"]})'
-        f' - {ingredient["amount"]}'
-        for ingredient in ingredients
-    ])
-    shopping_list += f'\n\nFoodgram ({today:%Y})'
-
-    response = HttpResponse(
-        shopping_list, content_type='text.txt; charset=utf-8'
+    if isinstance(request._request, ASGIRequest):
+        content = async_chunks(content, settings.SHOPPING_LIST_CHUNK_SIZE)
+    response = StreamingHttpResponse(
+        content,
+        content_type=f'{renderer.media_type}; charset={renderer.charset}'
     )
     response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
@@ -0,0 +1,332 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import get_context
+from threading import Lock
+from time import time
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils.encoding import filepath_to_uri
+from PIL import Image, ImageOps
+
+from ..cache import RECIPE_FEED, bump_version
+from recipe.models import Recipe, RecipeImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Расширения файлов для RECIPE_IMAGE_FORMAT
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+# Хранилище картинок рецептов и их размеров: имя файла в нём - хэш
+# содержимого, поэтому каталог размеров общий с картинками
+storage = Recipe._meta.get_field('image').storage
+upload_to = Recipe._meta.get_field('image').upload_to
+
+# Пул процессов текущего воркера, создаётся при первой загрузке картинки
+pool = None
+pool_lock = Lock()
+
+
+def get_pool():
+    """Пул RECIPE_IMAGE_WORKERS процессов для обработки картинок.
+        spawn: дочерний процесс поднимает Django заново и не делит
+        с воркером соединения с базой.
+    """
+
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                mp_context=get_context('spawn'),
+                initializer=django.setup,
+            )
+        return pool
+
+
+def reset_pool(broken):
+    """Убирает пул broken, если он ещё текущий: следующий get_pool()
+        создаст новый. Пул ломается, когда процесс в нём погиб
+        (например, от нехватки памяти на огромной картинке), и после
+        этого отклоняет все новые задачи.
+    """
+
+    global pool
+    with pool_lock:
+        if pool is broken:
+            pool = None
+    broken.shutdown(wait=False)
+
+
+def make_variants(name):
+    """Сохраняет картинку name во всех размерах из RECIPE_IMAGE_SIZES.
+        Возвращает {размер: {'name', 'width', 'height'}}.
+    """
+
+    image_format = settings.RECIPE_IMAGE_FORMAT
+    variants = {}
+    with storage.open(name) as file, Image.open(file) as source:
+        source = ImageOps.exif_transpose(source)
+        transparent = image_format == 'WEBP' and (
+            'A' in source.getbands() or 'transparency' in source.info
+        )
+        source = source.convert('RGBA' if transparent else 'RGB')
+        for size, box in settings.RECIPE_IMAGE_SIZES.items():
+            image = source.copy()
+            if box is not None:
+                image.thumbnail(box, Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(
+                buffer,
+                image_format,
+                quality=settings.RECIPE_IMAGE_QUALITY,
+                optimize=True,
+            )
+            variants[size] = {
+                'name': storage.save(
+                    f'{upload_to}{size}.{EXTENSIONS[image_format]}',
+                    ContentFile(buffer.getvalue()),
+                ),
+                'width': image.width,
+                'height': image.height,
+            }
+    return variants
+
+
+def image_files(image, image_variants):
+    """Имена всех файлов картинки рецепта: исходника и размеров."""
+
+    return [image] + [
+        variant['name']
+        for variant in image_variants.get('sizes', {}).values()
+    ]
+
+
+def is_referenced(name):
+    """Ссылается ли на файл хоть один рецепт: картинкой или её
+        размером. Оба поиска идут по индексу.
+    """
+
+    return (
+        Recipe.objects.filter(image=name).exists()
+        or RecipeImageVariant.objects.filter(name=name).exists()
+    )
+
+
+def delete_unused(name, grace, dry_run=False):
+    """Удаляет файл name, если он старше grace секунд и на него
+        не ссылается ни один рецепт. Возвращает, удалён ли файл.
+
+        Одновременная загрузка того же содержимого не пишет файл
+        заново, а только обновляет его mtime (ContentAddressedStorage).
+        Поэтому файл сначала атомарно переносится в корзину, и его mtime
+        сверяется ещё раз: если файл успели сохранить заново, он
+        возвращается на место. После переноса повторная загрузка
+        не найдёт файл и запишет его сама.
+    """
+
+    path = storage.path(name)
+    try:
+        modified = os.path.getmtime(path)
+    except FileNotFoundError:
+        return False
+    if time() - modified < grace or is_referenced(name):
+        return False
+    if dry_run:
+        return True
+    trash = f'{path}.trash'
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return False
+    if os.path.getmtime(trash) != modified:
+        os.replace(trash, path)
+        return False
+    os.remove(trash)
+    return True
+
+
+def release_files(names):
+    """Удаляет файлы, на которые больше не ссылается ни один рецепт.
+        Файлы, сохранённые за последние MEDIA_GARBAGE_GRACE секунд,
+        остаются: их может использовать ещё не закоммиченный рецепт.
+        Такие файлы позже удалит collect_media_garbage.
+    """
+
+    return sum(
+        delete_unused(name, settings.MEDIA_GARBAGE_GRACE)
+        for name in set(filter(None, names))
+    )
+
+
+def save_variants(recipe_id, image_variants):
+    """Переписывает строки RecipeImageVariant рецепта по image_variants."""
+
+    RecipeImageVariant.objects.filter(recipe_id=recipe_id).delete()
+    RecipeImageVariant.objects.bulk_create(
+        RecipeImageVariant(
+            recipe_id=recipe_id, size=size, name=variant['name']
+        )
+        for size, variant in image_variants['sizes'].items()
+    )
+
+
+def process_image(recipe_id, name, rebuild=False, previous=None):
+    """Готовит размеры картинки name рецепта recipe_id.
+        Готовые размеры той же картинки берутся у другого рецепта, если
+        не задан rebuild. После обновления освобождаются файлы прежней
+        картинки, а если за это время картинку заменили или рецепт
+        удалили - новые. previous - картинка, которую заменила name:
+        пока её размеры не готовы, в image_variants её нет.
+    """
+
+    old = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image_variants', flat=True
+    ).first()
+    image_variants = None
+    if not rebuild:
+        image_variants = Recipe.objects.filter(
+            image=name, image_variants__source=name
+        ).values_list('image_variants', flat=True).first()
+    if image_variants is None:
+        image_variants = {'source': name, 'sizes': make_variants(name)}
+    with transaction.atomic():
+        updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=image_variants
+        )
+        if updated:
+            save_variants(recipe_id, image_variants)
+    if not updated:
+        release_files(image_files(name, image_variants) + [previous])
+        return
+    bump_version(RECIPE_FEED)
+    old = old or {}
+    release_files(image_files(old.get('source'), old) + [previous])
+
+
+def process_image_in_pool(recipe_id, name, rebuild=False, previous=None):
+    """process_image() в процессе пула."""
+
+    try:
+        process_image(recipe_id, name, rebuild, previous)
+    finally:
+        close_old_connections()
+
+
+def log_failure(future):
+    if future.exception() is not None:
+        logger.error(
+            'Не удалось обработать картинку', exc_info=future.exception()
+        )
+
+
+def release_files_in_pool(names):
+    """release_files() в процессе пула."""
+
+    try:
+        release_files(names)
+    finally:
+        close_old_connections()
+
+
+def submit(function, *args):
+    """После коммита выполняет function в пуле процессов, при
+        RECIPE_IMAGE_WORKERS = 0 - в самом запросе.
+    """
+
+    if not settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(lambda: function(*args))
+        return
+    transaction.on_commit(lambda: submit_to_pool(function, *args))
+
+
+def submit_to_pool(function, *args):
+    """Отдаёт задачу в пул, возвращает future. Сломанный пул
+        создаётся заново. Задачи, которые были в сломанном пуле,
+        пропадают с ошибкой в логе, их картинки доделывает
+        process_recipe_images.
+    """
+
+    current = get_pool()
+    try:
+        future = current.submit(function, *args)
+    except BrokenProcessPool:
+        logger.warning('Пул обработки картинок сломан, создаётся новый')
+        reset_pool(current)
+        future = get_pool().submit(function, *args)
+    future.add_done_callback(log_failure)
+    return future
+
+
+def schedule_release(recipe):
+    """Файлы удалённого рецепта уходят сборщику мусора."""
+
+    submit(
+        release_files_in_pool,
+        image_files(recipe.image.name, recipe.image_variants)
+    )
+
+
+def schedule_image_processing(recipe):
+    """После коммита отдаёт новую картинку рецепта в пул процессов.
+        При RECIPE_IMAGE_WORKERS = 0 обработка идёт в самом запросе.
+    """
+
+    name = recipe.image.name
+    previous = getattr(recipe, 'loaded_image', None)
+    recipe.loaded_image = name
+    if not name or recipe.image_variants.get('source') == name:
+        return
+    submit(
+        process_image_in_pool,
+        recipe.pk,
+        name,
+        False,
+        previous if previous != name else None,
+    )
+
+
+def media_url(name, request=None):
+    """URL файла хранилища картинок, как storage.url() и
+        request.build_absolute_uri(). Начало URL считается один раз
+        на запрос: на странице ленты сотни картинок.
+    """
+
+    if request is None:
+        prefix = storage.base_url
+    else:
+        if not hasattr(request, '_media_url_prefix'):
+            request._media_url_prefix = request.build_absolute_uri(
+                storage.base_url
+            )
+        prefix = request._media_url_prefix
+    return prefix + filepath_to_uri(name).lstrip('/')
+
+
+def image_sizes(name, image_variants, request=None):
+    """URL, ширина и высота картинки name рецепта каждого размера из
+        RECIPE_IMAGE_SIZES. Размеры берутся из image_variants, файлы
+        не открываются. Пока размеры не готовы, все URL ведут
+        на исходную картинку, а ширина и высота неизвестны.
+    """
+
+    sizes = {}
+    if image_variants.get('source') == name:
+        sizes = image_variants['sizes']
+    images = {}
+    for size in settings.RECIPE_IMAGE_SIZES:
+        variant = sizes.get(size, {})
+        images[size] = {
+            'url': (
+                media_url(variant.get('name', name), request)
+                if name else None
+            ),
+            'width': variant.get('width'),
+            'height': variant.get('height'),
+        }
+    return images
@@ -0,0 +1,88 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import FastJSONRenderer
+from api.row_serializers import RecipeRowSerializer
+from api.serializers import RecipeReadListSerializer
+from recipe.models import Favorite, Recipe
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает побайтно ленту рецептов из RecipeRowSerializer '
+        'с RecipeReadListSerializer и падает при расхождении.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Рецептов на странице.',
+        )
+        parser.add_argument(
+            '--pages',
+            type=int,
+            help='Сколько страниц проверить; по умолчанию - все.',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='id пользователя для флагов; по умолчанию - '
+                 'с наибольшим <избранным>.',
+        )
+
+    def handle(self, *args, **options):
+        users = [AnonymousUser(), self.get_user(options['user'])]
+        checked = 0
+        mismatches = []
+        for user in users:
+            request = Request(APIRequestFactory().get('/api/recipes/'))
+            request.user = user
+            context = {'request': request}
+            queryset = Recipe.objects.with_user_flags(user)
+            rows = RecipeRowSerializer(context)
+            for offset in self.offsets(queryset, options):
+                page = queryset[offset:offset + options['page_size']]
+                expected = JSONRenderer().render(
+                    RecipeReadListSerializer(
+                        page, many=True, context=context
+                    ).data
+                )
+                actual = FastJSONRenderer().render(
+                    rows.to_representation(list(rows.values(page)))
+                )
+                checked += 1
+                if actual != expected:
+                    mismatches.append((user, offset))
+                    self.stderr.write(
+                        f'Расхождение: {user}, рецепты с {offset}'
+                    )
+        if mismatches:
+            raise CommandError(
+                f'Страниц с расхождениями: {len(mismatches)} из {checked}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Страниц проверено: {checked}, расхождений нет'
+        ))
+
+    def offsets(self, queryset, options):
+        total = queryset.count()
+        if options['pages'] is not None:
+            total = min(total, options['pages'] * options['page_size'])
+        return range(0, total, options['page_size'])
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            return User.objects.get(pk=user_id)
+        favorite = Favorite.objects.values('user').annotate(
+            total=Count('id')
+        ).order_by('-total').first()
+        if favorite is None:
+            return User.objects.first() or AnonymousUser()
+        return User.objects.get(pk=favorite['user'])
@@ -0,0 +1,61 @@
+from time import monotonic, sleep
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from api.manage.images import delete_unused, storage, upload_to
+
+
+class Command(BaseCommand):
+    help = ('Удаляет файлы картинок рецептов, на которые не ссылается '
+            'ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace',
+            type=int,
+            default=settings.MEDIA_GARBAGE_GRACE,
+            help='Не трогать файлы моложе стольких секунд.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument(
+            '--loop',
+            type=int,
+            metavar='SECONDS',
+            help='Работать постоянно, запуская сборку раз в SECONDS.',
+        )
+
+    def walk(self, directory):
+        directories, files = storage.listdir(directory)
+        for name in files:
+            yield f'{directory}/{name}'
+        for name in directories:
+            yield from self.walk(f'{directory}/{name}')
+
+    def handle(self, *args, **options):
+        while True:
+            self.collect(options['grace'], options['dry_run'])
+            if not options['loop']:
+                break
+            sleep(options['loop'])
+
+    def collect(self, grace, dry_run):
+        started = monotonic()
+        checked = deleted = 0
+        if not storage.exists(upload_to):
+            return
+        for name in self.walk(upload_to.rstrip('/')):
+            checked += 1
+            if not delete_unused(name, grace, dry_run):
+                continue
+            deleted += 1
+            if dry_run:
+                self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {checked}, без ссылок: {deleted}, '
+            f'за {monotonic() - started:.2f} с'
+        ))
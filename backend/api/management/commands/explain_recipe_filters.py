@@ -0,0 +1,158 @@
+import json
+from itertools import combinations
+from types import SimpleNamespace
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from api.filters import RecipeFilter
+from recipe.models import Favorite, Recipe, Tag
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет EXPLAIN для всех сочетаний фильтров ленты рецептов '
+        'с каждой сортировкой (?ordering=) и падает, если в плане есть '
+        'Seq Scan по большой таблице.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-seq-rows',
+            type=int,
+            default=1000,
+            help='Допустимый размер таблицы (строк) для Seq Scan.',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=6,
+            help='Размер страницы ленты.',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='id пользователя для is_favorited/is_in_shopping_cart; '
+                 'по умолчанию - с наибольшим <избранным>.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Аудит планов работает только с PostgreSQL')
+        user = self.get_user(options['user'])
+        values = self.get_filter_values(user)
+        violations = []
+        request = SimpleNamespace(user=user)
+        for data, label in self.filter_sets(values):
+            queryset = RecipeFilter(
+                data,
+                queryset=Recipe.objects.with_user_flags(user),
+                request=request,
+            ).qs
+            # COUNT(*) с ?ordering= - без JOIN с рейтингами, как
+            # в RecipeViewSet.get_count_queryset()
+            count_queryset = RecipeFilter(
+                {name: value for name, value in data.items()
+                 if name != 'ordering'},
+                queryset=Recipe.objects.all(),
+                request=request,
+            ).qs
+            for kind, plan in self.explain(
+                queryset, count_queryset, options['limit']
+            ):
+                scans = [
+                    scan for scan in self.seq_scans(plan)
+                    if scan[1] > options['max_seq_rows']
+                ]
+                for relation, rows in scans:
+                    violations.append(
+                        f'{label} ({kind}): Seq Scan {relation} '
+                        f'~{rows} строк'
+                    )
+                style = self.style.ERROR if scans else self.style.SUCCESS
+                self.stdout.write(style(
+                    f'{label} ({kind}): '
+                    f'cost {plan["Total Cost"]}, '
+                    f'Seq Scan: {len(scans)}'
+                ))
+        if violations:
+            raise CommandError('\n'.join(violations))
+
+    def filter_sets(self, values):
+        """Все сочетания фильтров, каждое - без сортировки и с каждым
+            значением ?ordering=: (данные фильтра, подпись).
+        """
+
+        orderings = [None] + [
+            value for value, _ in
+            RecipeFilter.base_filters['ordering'].extra['choices']
+        ]
+        for ordering in orderings:
+            for size in range(len(values) + 1):
+                for names in combinations(values, size):
+                    data = {name: values[name] for name in names}
+                    label = ', '.join(names) or 'без фильтров'
+                    if ordering is not None:
+                        data['ordering'] = ordering
+                        label += f', ordering={ordering}'
+                    yield data, label
+
+    def get_user(self, user_id):
+        if user_id is not None:
+            return User.objects.get(pk=user_id)
+        favorite = Favorite.objects.values('user').annotate(
+            total=Count('id')
+        ).order_by('-total').first()
+        if favorite is None:
+            raise CommandError('Нет данных: сначала заполните базу')
+        return User.objects.get(pk=favorite['user'])
+
+    def get_filter_values(self, user):
+        """Самые <тяжёлые> значения фильтров в текущих данных."""
+
+        tags = Tag.objects.annotate(
+            total=Count('recipes')
+        ).order_by('-total').values_list('slug', flat=True)[:2]
+        author = Recipe.objects.values('author').annotate(
+            total=Count('id')
+        ).order_by('-total').first()
+        return {
+            'tags': list(tags),
+            'author': author['author'],
+            'is_favorited': True,
+            'is_in_shopping_cart': True,
+        }
+
+    def explain(self, queryset, count_queryset, limit):
+        """Планы запроса страницы и запроса количества."""
+
+        page = json.loads(queryset[:limit].explain(format='json'))
+        sql, params = count_queryset.values('pk').query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'EXPLAIN (FORMAT JSON) '
+                f'SELECT COUNT(*) FROM ({sql}) subquery',
+                params
+            )
+            count = cursor.fetchone()[0]
+        if isinstance(count, str):
+            count = json.loads(count)
+        return (('page', page[0]['Plan']), ('count', count[0]['Plan']))
+
+    def seq_scans(self, plan):
+        """Seq Scan плана: (таблица, строк в таблице по статистике)."""
+
+        if plan['Node Type'] == 'Seq Scan':
+            yield plan['Relation Name'], self.table_rows(plan['Relation Name'])
+        for child in plan.get('Plans', ()):
+            yield from self.seq_scans(child)
+
+    def table_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                (table,)
+            )
+            return max(cursor.fetchone()[0], 0)
@@ -0,0 +1,402 @@
+import csv
+import json
+from datetime import timedelta
+from io import BytesIO, StringIO
+from itertools import accumulate
+from random import Random
+from time import monotonic
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError, call_command
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from api.cache import RECIPE_FEED, bump_model_version, bump_version
+from api.manage.images import make_variants, storage, upload_to
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           RecipeImageVariant, RecipeScore, ShoppingCart,
+                           Tag)
+from user.models import Subscription, User
+
+FIRST_NAMES = (
+    'Анна', 'Борис', 'Вера', 'Глеб', 'Дарья', 'Егор', 'Жанна', 'Иван',
+    'Ксения', 'Лев', 'Мария', 'Никита', 'Ольга', 'Пётр', 'Софья', 'Тимур',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков',
+)
+WORDS = (
+    'нарезать', 'смешать', 'добавить', 'обжарить', 'варить', 'посолить',
+    'лук', 'морковь', 'масло', 'соус', 'до', 'готовности', 'минут', 'на',
+    'среднем', 'огне', 'затем', 'и', 'подавать', 'горячим', 'с', 'зеленью',
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+# За сколько последних дней разбросаны <избранное> и <списки покупок>
+EVENTS_DAYS = 60
+
+
+class TableWriter:
+    """Пишет строки в таблицу пачками мимо ORM: без сигналов и
+        auto_now_add. В PostgreSQL - через COPY, в других базах -
+        через executemany. Значения должны быть готовы для базы.
+    """
+
+    def __init__(self, model, fields, batch_size):
+        quote = connection.ops.quote_name
+        self.table = quote(model._meta.db_table)
+        self.columns = ', '.join(
+            quote(model._meta.get_field(field).column) for field in fields
+        )
+        self.placeholders = ', '.join(['%s'] * len(fields))
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+
+    def add(self, *row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                buffer = StringIO()
+                csv.writer(
+                    buffer, quoting=csv.QUOTE_NONNUMERIC
+                ).writerows(self.rows)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {self.table} ({self.columns}) '
+                    f'FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+            else:
+                cursor.executemany(
+                    f'INSERT INTO {self.table} ({self.columns}) '
+                    f'VALUES ({self.placeholders})',
+                    self.rows,
+                )
+        self.written += len(self.rows)
+        self.rows = []
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, рецептами, '
+        '<избранным>, <списками покупок> и подписками со степенным '
+        'распределением популярности. При одном --seed и одной исходной '
+        'базе данные одинаковые.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=10_000,
+            help='Сколько рецептов создать.',
+        )
+        parser.add_argument(
+            '--users', type=int,
+            help='Сколько пользователей создать; по умолчанию - '
+                 'десятая часть рецептов.',
+        )
+        parser.add_argument(
+            '--tags', type=int, default=30,
+            help='Сколько тегов должно быть в базе.',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Сколько ингредиентов должно быть в базе.',
+        )
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число рецептов в <избранном> пользователя.',
+        )
+        parser.add_argument(
+            '--carts', type=float, default=3,
+            help='Среднее число рецептов в <списке покупок>.',
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=5,
+            help='Среднее число подписок пользователя.',
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='Показатель степенного закона, больше 1: чем больше, '
+                 'тем сильнее перекос в сторону популярного.',
+        )
+        parser.add_argument(
+            '--days', type=int, default=3 * 365,
+            help='За сколько дней разбросаны даты публикации рецептов.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--batch-size', type=int, default=10_000,
+            help='Строк в одном COPY или INSERT.',
+        )
+
+    def handle(self, *args, **options):
+        if options['alpha'] <= 1:
+            raise CommandError('--alpha должен быть больше 1')
+        self.options = options
+        self.random = Random(options['seed'])
+        self.now = timezone.now()
+        started = monotonic()
+        with transaction.atomic():
+            tag_ids = self.make_tags(options['tags'])
+            ingredient_ids = self.make_ingredients(options['ingredients'])
+            user_ids = self.make_users(
+                options['users'] or max(options['recipes'] // 10, 10)
+            )
+            author_weights = self.zipf(len(user_ids))
+            recipe_ids = self.make_recipes(
+                options['recipes'], user_ids, author_weights,
+                tag_ids, ingredient_ids,
+            )
+            recipe_weights = self.zipf(len(recipe_ids))
+            for model, mean in (
+                (Favorite, options['favorites']),
+                (ShoppingCart, options['carts']),
+            ):
+                self.make_events(
+                    model, mean, user_ids, recipe_ids, recipe_weights
+                )
+            self.make_subscriptions(user_ids, author_weights)
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), (User, Recipe)
+                ):
+                    cursor.execute(sql)
+        # Денормализованные данные - теми же командами, что чинят их
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('rebuild_shopping_cart_totals', stdout=self.stdout)
+        call_command('refresh_recipe_scores', stdout=self.stdout)
+        for model in (Tag, Ingredient):
+            bump_model_version(model)
+        bump_version(RECIPE_FEED)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные созданы за {monotonic() - started:.1f} с'
+        ))
+
+    def zipf(self, size):
+        """Накопленные веса 1/rank^alpha для элементов в случайном порядке:
+            популярные элементы разбросаны по всему диапазону id.
+        """
+
+        ranks = list(range(1, size + 1))
+        self.random.shuffle(ranks)
+        alpha = self.options['alpha']
+        return list(accumulate(rank ** -alpha for rank in ranks))
+
+    def activity(self, mean, limit):
+        """Число действий пользователя: распределение Парето
+            со средним mean, не больше limit.
+        """
+
+        alpha = self.options['alpha']
+        value = mean * (alpha - 1) / alpha * self.random.paretovariate(alpha)
+        return min(int(value), limit)
+
+    def sample(self, population, cum_weights, count):
+        """count разных элементов с весами (повторы отбрасываются)."""
+
+        return set(self.random.choices(
+            population, cum_weights=cum_weights, k=count
+        ))
+
+    def next_id(self, model):
+        return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+    def report(self, label, writer, started):
+        elapsed = monotonic() - started
+        self.stdout.write(
+            f'{label}: {writer.written} за {elapsed:.1f} с '
+            f'({writer.written / max(elapsed, 1e-6):.0f} строк/с)'
+        )
+
+    def make_tags(self, total):
+        existing = Tag.objects.count()
+        Tag.objects.bulk_create(
+            (
+                Tag(name=f'Тег{number}', color=f'#{number:06x}',
+                    slug=f'tag{number}')
+                for number in range(existing, total)
+            ),
+            ignore_conflicts=True,
+        )
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def make_ingredients(self, total):
+        existing = Ingredient.objects.count()
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(
+                    name=f'ингредиент{number}',
+                    measurement_unit=self.random.choice(UNITS),
+                )
+                for number in range(existing, total)
+            ),
+            batch_size=self.options['batch_size'],
+            ignore_conflicts=True,
+        )
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+
+    def make_users(self, total):
+        started = monotonic()
+        first_id = self.next_id(User)
+        # Один хэш на всех: хэширование пароля нарочно медленное
+        password = make_password('synthetic')
+        writer = TableWriter(
+            User,
+            ('id', 'username', 'email', 'first_name', 'last_name',
+             'password', 'is_superuser', 'is_staff', 'is_active',
+             'date_joined', 'recipes_count', 'subscribers_count'),
+            self.options['batch_size'],
+        )
+        for user_id in range(first_id, first_id + total):
+            joined = self.now - timedelta(
+                days=self.random.uniform(0, self.options['days'])
+            )
+            writer.add(
+                user_id, f'cook{user_id}', f'cook{user_id}@example.com',
+                self.random.choice(FIRST_NAMES),
+                self.random.choice(LAST_NAMES),
+                password, False, False, True,
+                connection.ops.adapt_datetimefield_value(joined), 0, 0,
+            )
+        writer.flush()
+        self.report('Пользователи', writer, started)
+        return range(first_id, first_id + total)
+
+    def make_image(self):
+        """Одна картинка на все рецепты: в хранилище по хэшу
+            содержимого она и её размеры лежат один раз.
+        """
+
+        buffer = BytesIO()
+        Image.linear_gradient('L').resize((1200, 800)).convert('RGB').save(
+            buffer, 'JPEG'
+        )
+        name = storage.save(
+            f'{upload_to}synthetic.jpg', ContentFile(buffer.getvalue())
+        )
+        return name, json.dumps({'source': name, 'sizes': make_variants(name)})
+
+    def make_recipes(self, total, user_ids, author_weights, tag_ids,
+                     ingredient_ids):
+        started = monotonic()
+        batch_size = self.options['batch_size']
+        first_id = self.next_id(Recipe)
+        image, image_variants = self.make_image()
+        authors = self.random.choices(
+            user_ids, cum_weights=author_weights, k=total
+        )
+        tag_weights = self.zipf(len(tag_ids))
+        ingredient_weights = self.zipf(len(ingredient_ids))
+        recipes = TableWriter(
+            Recipe,
+            ('id', 'name', 'author', 'text', 'image', 'image_variants',
+             'cooking_time', 'pub_date', 'favorites_count'),
+            batch_size,
+        )
+        tags = TableWriter(
+            Recipe.tags.through, ('recipe', 'tag'), batch_size
+        )
+        ingredients = TableWriter(
+            IngredientInRecipe, ('recipe', 'ingredient', 'amount'),
+            batch_size,
+        )
+        scores = TableWriter(
+            RecipeScore, ('recipe', 'popular', 'trending', 'dirty'),
+            batch_size,
+        )
+        variants = TableWriter(
+            RecipeImageVariant, ('recipe', 'size', 'name'), batch_size
+        )
+        sizes = json.loads(image_variants)['sizes']
+        today = self.now.date()
+        for number, author_id in enumerate(authors):
+            recipe_id = first_id + number
+            # Чем больше id, тем новее рецепт, как в живой базе
+            pub_date = today - timedelta(
+                days=self.options['days'] * (total - 1 - number) // total
+            )
+            recipes.add(
+                recipe_id, f'Рецепт{recipe_id}', author_id,
+                ' '.join(self.random.choices(
+                    WORDS, k=self.random.randint(20, 80)
+                )),
+                image, image_variants,
+                max(1, min(int(self.random.lognormvariate(3.4, 0.6)), 600)),
+                connection.ops.adapt_datefield_value(pub_date), 0,
+            )
+            for tag_id in self.sample(
+                tag_ids, tag_weights, self.random.randint(1, 3)
+            ):
+                tags.add(recipe_id, tag_id)
+            for ingredient_id in self.sample(
+                ingredient_ids, ingredient_weights, self.random.randint(3, 12)
+            ):
+                ingredients.add(
+                    recipe_id, ingredient_id, self.random.randint(1, 500)
+                )
+            scores.add(recipe_id, 0.0, 0.0, True)
+            for size, variant in sizes.items():
+                variants.add(recipe_id, size, variant['name'])
+        for writer in (recipes, tags, ingredients, scores, variants):
+            writer.flush()
+        for label, writer in (
+            ('Рецепты', recipes), ('Теги рецептов', tags),
+            ('Ингредиенты рецептов', ingredients),
+        ):
+            self.report(label, writer, started)
+        return range(first_id, first_id + total)
+
+    def make_events(self, model, mean, user_ids, recipe_ids, recipe_weights):
+        """<Избранное> или <список покупок>: активность пользователей и
+            популярность рецептов - по степенному закону.
+        """
+
+        started = monotonic()
+        writer = TableWriter(
+            model, ('user', 'recipe', 'pub_date'), self.options['batch_size']
+        )
+        for user_id in user_ids:
+            count = self.activity(mean, len(recipe_ids))
+            for recipe_id in sorted(
+                self.sample(recipe_ids, recipe_weights, count)
+            ):
+                added = self.now - timedelta(
+                    seconds=self.random.uniform(0, EVENTS_DAYS * 86400)
+                )
+                writer.add(
+                    user_id, recipe_id,
+                    connection.ops.adapt_datetimefield_value(added),
+                )
+        writer.flush()
+        self.report(model._meta.verbose_name_plural, writer, started)
+
+    def make_subscriptions(self, user_ids, author_weights):
+        """Подписываются чаще на авторов с большим числом рецептов."""
+
+        started = monotonic()
+        writer = TableWriter(
+            Subscription, ('user', 'author'), self.options['batch_size']
+        )
+        for user_id in user_ids:
+            count = self.activity(
+                self.options['subscriptions'], len(user_ids)
+            )
+            for author_id in sorted(
+                self.sample(user_ids, author_weights, count) - {user_id}
+            ):
+                writer.add(user_id, author_id)
+        writer.flush()
+        self.report('Подписки', writer, started)
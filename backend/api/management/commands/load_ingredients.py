@@ -0,0 +1,193 @@
+import csv
+import json
+import os
+import re
+from time import monotonic
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from api.cache import RECIPE_FEED, bump_model_version, bump_version
+from recipe.models import Ingredient
+
+# Пробелы и запятые между элементами массива JSON
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV (название, единица измерения), '
+        'JSON Lines или массива JSON. Файл читается построчно, '
+        'существующим ингредиентам обновляется единица измерения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(settings.DATA_DIR, 'ingredients.csv'),
+            help='Файл с ингредиентами, по умолчанию '
+                 'ingredients.csv из DATA_DIR.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла; по умолчанию - по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Строк в одном INSERT ... ON CONFLICT.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1 << 16,
+            help='Символов, читаемых из массива JSON за раз.',
+        )
+        parser.add_argument(
+            '--max-item-size',
+            type=int,
+            default=1 << 20,
+            help='Наибольшая длина объекта массива JSON в символах.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.lower().endswith('.csv') else 'json'
+        )
+        batch = {}
+        total = 0
+        started = reported = monotonic()
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                if file_format == 'csv':
+                    rows = self.read_csv(file)
+                else:
+                    rows = self.read_json(
+                        file, options['chunk_size'], options['max_item_size']
+                    )
+                for name, measurement_unit in rows:
+                    batch[name] = measurement_unit
+                    if len(batch) >= options['batch_size']:
+                        total += self.save(batch)
+                        if monotonic() - reported >= 5:
+                            reported = monotonic()
+                            self.stdout.write(self.progress(total, started))
+                total += self.save(batch)
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        bump_model_version(Ingredient)
+        bump_version(RECIPE_FEED)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты в базе! {self.progress(total, started)}'
+        ))
+
+    def save(self, batch):
+        """Вставляет пачку, на совпадении названия - обновляет единицу.
+            В пачке каждое название один раз: иначе ON CONFLICT
+            DO UPDATE дважды затронет одну строку.
+        """
+
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch.items()
+            ),
+            update_conflicts=True,
+            unique_fields=('name',),
+            update_fields=('measurement_unit',),
+        )
+        saved = len(batch)
+        batch.clear()
+        return saved
+
+    def progress(self, total, started):
+        elapsed = monotonic() - started
+        return (
+            f'Строк: {total} за {elapsed:.1f} с '
+            f'({total / max(elapsed, 1e-6):.0f} строк/с)'
+        )
+
+    def clean(self, name, measurement_unit, line):
+        name, measurement_unit = name.strip(), measurement_unit.strip()
+        if not name or not measurement_unit:
+            raise CommandError(f'Строка {line}: пустое название или единица')
+        return name, measurement_unit
+
+    def read_csv(self, file):
+        """Строки CSV; заголовок name,measurement_unit пропускается."""
+
+        for line, row in enumerate(csv.reader(file), 1):
+            if not row:
+                continue
+            if len(row) != 2:
+                raise CommandError(f'Строка {line}: нужно два столбца')
+            if line == 1 and row == ['name', 'measurement_unit']:
+                continue
+            yield self.clean(*row, line)
+
+    def read_json(self, file, chunk_size, max_item_size):
+        """Объекты {"name", "measurement_unit"} из массива JSON или
+            JSON Lines - по первому символу файла.
+        """
+
+        start = file.read(chunk_size).lstrip()
+        if start.startswith('['):
+            return self.read_json_array(
+                file, start[1:], chunk_size, max_item_size
+            )
+        file.seek(0)
+        return self.read_json_lines(file)
+
+    def read_json_lines(self, file):
+        for line, text in enumerate(file, 1):
+            if not text.strip():
+                continue
+            try:
+                item = json.loads(text)
+            except json.JSONDecodeError as error:
+                raise CommandError(f'Строка {line}: {error}')
+            yield self.clean_json(item, line)
+
+    def read_json_array(self, file, buffer, chunk_size, max_item_size):
+        """Массив читается кусками по chunk_size и разбирается
+            по одному объекту через raw_decode. Объект, который
+            не разобрался и за max_item_size символов, считается
+            повреждённым: иначе один битый объект дочитал бы в память
+            весь файл.
+        """
+
+        decoder = json.JSONDecoder()
+        position = 0
+        number = 0
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if len(buffer) - position >= max_item_size:
+                    raise CommandError(
+                        f'Объект {number + 1}: повреждён или длиннее '
+                        f'{max_item_size} символов'
+                    )
+                more = file.read(chunk_size)
+                if not more:
+                    raise CommandError('Массив JSON оборван или повреждён')
+                buffer = buffer[position:] + more
+                position = 0
+                continue
+            number += 1
+            yield self.clean_json(item, number)
+
+    def clean_json(self, item, line):
+        try:
+            return self.clean(item['name'], item['measurement_unit'], line)
+        except (KeyError, TypeError, AttributeError):
+            raise CommandError(
+                f'Объект {line}: нужны строки name и measurement_unit'
+            )
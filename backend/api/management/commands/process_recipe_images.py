@@ -0,0 +1,40 @@
+from concurrent.futures import as_completed
+from time import monotonic
+
+from django.core.management import BaseCommand
+
+from api.manage.images import get_pool, process_image_in_pool
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Готовит размеры картинок рецептов (RECIPE_IMAGE_SIZES).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Пересобрать размеры всех картинок, а не только новых.',
+        )
+
+    def handle(self, *args, **options):
+        started = monotonic()
+        recipes = Recipe.objects.exclude(image='').values_list(
+            'id', 'image', 'image_variants'
+        )
+        futures = [
+            get_pool().submit(
+                process_image_in_pool, recipe_id, name, options['all']
+            )
+            for recipe_id, name, image_variants in recipes.iterator()
+            if options['all'] or image_variants.get('source') != name
+        ]
+        failed = 0
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed += 1
+                self.stderr.write(str(future.exception()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {len(futures) - failed}, '
+            f'ошибок: {failed}, за {monotonic() - started:.2f} с'
+        ))
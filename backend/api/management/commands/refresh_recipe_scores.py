@@ -0,0 +1,60 @@
+from time import monotonic, sleep
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from api.cache import RECIPE_SCORES, bump_version
+from recipe.models import RecipeScore
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает рейтинги рецептов для ?ordering=popular|trending: '
+        'изменённые с прошлого запуска и ещё не затухшие.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать рейтинги всех рецептов.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько рецептов пересчитывать за раз.',
+        )
+        parser.add_argument(
+            '--loop',
+            type=int,
+            metavar='SECONDS',
+            help='Работать постоянно, запуская пересчёт раз в SECONDS.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.refresh(options['full'], options['batch_size'])
+            if not options['loop']:
+                break
+            sleep(options['loop'])
+
+    def refresh(self, full, batch_size):
+        started = monotonic()
+        now = timezone.now()
+        created = RecipeScore.objects.create_missing(batch_size)
+        scores = RecipeScore.objects.all()
+        if not full:
+            scores = scores.stale()
+        recipe_ids = list(scores.values_list('pk', flat=True))
+        for start in range(0, len(recipe_ids), batch_size):
+            RecipeScore.objects.recalculate(
+                recipe_ids[start:start + batch_size], now
+            )
+        if recipe_ids:
+            # Остальная лента от рейтингов не зависит и остаётся в кэше
+            bump_version(RECIPE_SCORES)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рейтингов: {len(recipe_ids)} '
+            f'(новых: {created}) за {monotonic() - started:.2f} с'
+        ))
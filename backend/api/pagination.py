@@ -1,6 +1,233 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator с кэшированным COUNT(*).
+
+    Количество кэшируется по версии данных cache_prefix и тексту запроса,
+    не дольше PAGINATION_COUNT_TIMEOUT секунд; без cache_prefix считается
+    как обычно. Для таблиц PostgreSQL без фильтров, где по статистике
+    больше APPROXIMATE_COUNT_THRESHOLD строк, берётся оценка из pg_class.
+    count_queryset() может вернуть queryset с тем же числом строк, который
+    дешевле посчитать; вызывается только при промахе кэша.
+    """
+
+    def __init__(self, *args, cache_prefix=None, count_queryset=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_prefix = cache_prefix
+        self.count_queryset = count_queryset
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return len(queryset)
+        if self.cache_prefix is None:
+            return self.count_rows()
+        sql, params = queryset.query.sql_with_params()
+        key = (
+            f'count:{self.cache_prefix}:'
+            f'{md5(f"{sql}{params}".encode()).hexdigest()}'
+        )
+        return cache.get_or_set(
+            key, self.count_rows, settings.PAGINATION_COUNT_TIMEOUT
+        )
+
+    def count_rows(self):
+        queryset = self.count_queryset and self.count_queryset()
+        if queryset is None:
+            queryset = self.object_list
+        return self.estimate_count(queryset) or queryset.count()
+
+    def estimate_count(self, queryset):
+        """Оценка числа строк по статистике PostgreSQL или None."""
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                (queryset.model._meta.db_table,)
+            )
+            row = cursor.fetchone()
+        if row is None or row[0] < settings.APPROXIMATE_COUNT_THRESHOLD:
+            return None
+        return row[0]
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по курсору: WHERE (поля сортировки) после курсора.
+
+    Поля берутся из сортировки queryset, в конец добавляется id, чтобы
+    ключ был уникальным. Не делает ни OFFSET, ни COUNT(*), поэтому
+    глубокие страницы не медленнее первой. Листает только вперёд.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+    page_size = 6
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.fields = [
+            self.get_field(queryset, field.lstrip('-'))
+            for field in self.ordering
+        ]
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        ordering = list(
+            queryset.query.order_by or queryset.model._meta.ordering
+        )
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return ordering
+
+    def get_field(self, queryset, name):
+        """Поле модели или аннотации, по которому идёт сортировка."""
+
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        *path, name = name.split(LOOKUP_SEP)
+        for part in path:
+            model = model._meta.get_field(part).related_model
+        if name == 'pk':
+            return model._meta.pk
+        return model._meta.get_field(name)
+
+    def after(self, position):
+        """Условие <строка после курсора> для составного ключа."""
+
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request):
+        """Значения полей сортировки из курсора, приведённые к типам полей.
+            Любой курсор, который не мог выдать encode_cursor(), - 404.
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode()))
+        except (DecodeError, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+            len(position) != len(self.ordering)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.fields, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, instance):
+        """Курсор после объекта или строки .values()."""
+
+        if isinstance(instance, dict):
+            position = [instance[field.lstrip('-')] for field in self.ordering]
+        else:
+            position = [
+                getattr(instance, field.lstrip('-'))
+                for field in self.ordering
+            ]
+        return urlsafe_b64encode(
+            json.dumps(position, cls=DjangoJSONEncoder).encode()
+        ).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
 
 
 class LimitPageNumberPagination(PageNumberPagination):
+    """Пагинация по номеру страницы; с параметром <cursor> - по курсору."""
+
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        self.cursor_pagination = None
+        get_prefix = getattr(view, 'get_count_cache_prefix', None)
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            cache_prefix=get_prefix() if get_prefix else None,
+            count_queryset=getattr(view, 'get_count_queryset', None),
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,125 @@
+import csv
+import json
+
+import orjson
+from rest_framework import renderers
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer на orjson, ответ совпадает побайтно.
+
+    Числа с плавающей точкой orjson пишет иначе (1e16 вместо 1e+16),
+    поэтому рендерер только для ответов без float. С отступом из Accept
+    и для данных, которые orjson не кодирует, работает JSONRenderer.
+    """
+
+    options = (
+        orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(
+            accepted_media_type, renderer_context or {}
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=self.options
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как в JSONRenderer: U+2028 и U+2029 недопустимы в JavaScript
+        return content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029'
+        )
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """Базовый рендерер <списка покупок> с потоковой выдачей.
+
+    data: {'user': ..., 'date': ..., 'ingredients': <итерируемые строки
+    с ключами name, measurement_unit, amount>}.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, dict) or 'ingredients' not in data:
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return ''.join(self.stream(**data)).encode(self.charset)
+
+    def stream(self, user, date, ingredients):
+        """Отдаёт файл частями по мере чтения строк из базы."""
+
+        raise NotImplementedError('stream() must be implemented.')
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    """Список покупок в формате *.txt."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, date, ingredients):
+        yield (
+            f'Список покупок для пользователя: {user.username}\n\n'
+            f'Дата: {date:%Y-%m-%d}\n\n'
+        )
+        separator = ''
+        for ingredient in ingredients:
+            yield (
+                f'{separator}- {ingredient["name"]} '
+                f'({ingredient["measurement_unit"]})'
+                f' - {ingredient["amount"]}'
+            )
+            separator = '\n'
+        yield f'\n\nFoodgram ({date:%Y})'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате *.csv."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, user, date, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['name'],
+                ingredient['measurement_unit'],
+                ingredient['amount'],
+            ))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    """Список покупок в формате *.json."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, user, date, ingredients):
+        yield (
+            f'{{"user": {json.dumps(user.username, ensure_ascii=False)}, '
+            f'"date": "{date:%Y-%m-%d}", "ingredients": ['
+        )
+        separator = ''
+        for ingredient in ingredients:
+            yield separator + json.dumps({
+                'name': ingredient['name'],
+                'measurement_unit': ingredient['measurement_unit'],
+                'amount': ingredient['amount'],
+            }, ensure_ascii=False)
+            separator = ', '
+        yield ']}'
@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+REPLICA = 'replica'
+
+# Алиас базы для чтения в текущем запросе, None - основная база
+read_db = ContextVar('read_db', default=None)
+
+
+def replica_enabled():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def read_from_primary():
+    """Чтение внутри блока - из основной базы.
+
+    Так собираются данные для общих кэшей: запись по новой версии,
+    собранная из отстающей реплики, жила бы до следующей версии.
+    """
+
+    token = read_db.set(None)
+    try:
+        yield
+    finally:
+        read_db.reset(token)
+
+
+def pin_key(user_id):
+    return f'replica_pin:{user_id}'
+
+
+def pin_to_primary(user):
+    """Пользователь REPLICA_PIN_SECONDS секунд читает из основной базы."""
+
+    cache.set(pin_key(user.id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(pin_key(user.id)) is not None
+
+
+class ReplicaRouter:
+    """Чтение - из базы read_db, всё остальное - в основную базу.
+
+    Внутри транзакции основной базы чтение идёт в неё же: транзакция
+    должна видеть свои изменения. На реплику миграции не применяются,
+    схему она получает от основной базы.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_db.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """GET-действия replica_actions читают из реплики.
+
+    Изменяющий запрос закрепляет пользователя за основной базой на
+    REPLICA_PIN_SECONDS секунд (pin_to_primary), чтобы он сразу видел
+    свои изменения. Аутентификация и проверка прав всегда идут в
+    основную базу.
+    """
+
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not replica_enabled():
+            return
+        if request.method not in SAFE_METHODS:
+            if request.user.is_authenticated:
+                pin_to_primary(request.user)
+        elif self.action in self.replica_actions and (
+            not is_pinned(request.user)
+        ):
+            read_db.set(REPLICA)
+
+    # Поток WSGI обслуживает следующие запросы с тем же контекстом:
+    # реплика не должна достаться ни их аутентификации, ни записи
+    def dispatch(self, request, *args, **kwargs):
+        read_db.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            read_db.set(None)
+
+    async def adispatch(self, handler, request, *args, **kwargs):
+        read_db.set(None)
+        try:
+            return await super().adispatch(handler, request, *args, **kwargs)
+        finally:
+            read_db.set(None)
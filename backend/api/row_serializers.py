@@ -0,0 +1,166 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import response
+
+from .manage.images import image_sizes, media_url
+from recipe.models import IngredientInRecipe, Recipe
+
+
+class RecipeRowSerializer:
+    """Лента рецептов из строк .values() без полей DRF.
+
+    Отдаёт то же, что RecipeReadListSerializer(many=True): рецепты
+    с автором читаются одним запросом плоскими строками, теги и
+    ингредиенты страницы - ещё двумя, словари собираются напрямую,
+    в порядке полей сериализатора. Совпадение ответов побайтно
+    проверяют RecipeRowsTestCase (api/tests.py) и, на живой базе,
+    manage.py check_recipe_rows.
+    """
+
+    recipe_fields = (
+        'id', 'name', 'image', 'image_variants', 'text', 'cooking_time',
+        'author_id', 'author__email', 'author__username',
+        'author__first_name', 'author__last_name',
+        'is_favorited', 'is_in_shopping_cart', 'is_author_subscribed',
+    )
+
+    def __init__(self, context=None):
+        self.context = context or {}
+
+    def values(self, queryset):
+        """Строки рецептов queryset. В строки попадают и поля
+            сортировки: по ним строится курсор KeysetPagination.
+        """
+
+        ordering = [
+            field.lstrip('-')
+            for field in queryset.query.order_by or Recipe._meta.ordering
+            if isinstance(field, str)
+        ]
+        return queryset.prefetch_related(None).values(
+            *self.recipe_fields,
+            *(field for field in ordering if field not in self.recipe_fields)
+        )
+
+    def get_tags(self, recipe_ids):
+        """{id рецепта: [тег, ...]}, словарь тега один на страницу."""
+
+        tags = {}
+        recipe_tags = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, tag_id, name, color, slug in (
+            Recipe.tags.through.objects.filter(
+                recipe_id__in=recipe_ids
+            ).order_by('tag_id').values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__color', 'tag__slug'
+            )
+        ):
+            tag = tags.get(tag_id)
+            if tag is None:
+                tag = tags[tag_id] = {
+                    'id': tag_id, 'name': name, 'color': color, 'slug': slug
+                }
+            recipe_tags[recipe_id].append(tag)
+        return recipe_tags
+
+    def get_ingredients(self, recipe_ids):
+        """{id рецепта: [ингредиент, ...]}."""
+
+        ingredients = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id, name, measurement_unit, amount in (
+            IngredientInRecipe.objects.filter(
+                recipe_id__in=recipe_ids
+            ).order_by('id').values_list(
+                'recipe_id', 'ingredient_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'
+            )
+        ):
+            ingredients[recipe_id].append({
+                'id': ingredient_id,
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+                'recipe': recipe_id,
+                'ingredient': ingredient_id,
+            })
+        return ingredients
+
+    def to_representation(self, rows):
+        request = self.context.get('request')
+        recipe_ids = [row['id'] for row in rows]
+        tags = self.get_tags(recipe_ids)
+        ingredients = self.get_ingredients(recipe_ids)
+        authors = {}
+        data = []
+        for row in rows:
+            author_id = row['author_id']
+            author = None
+            if author_id is not None:
+                author = authors.get(author_id)
+                if author is None:
+                    author = authors[author_id] = {
+                        'id': author_id,
+                        'email': row['author__email'],
+                        'username': row['author__username'],
+                        'first_name': row['author__first_name'],
+                        'last_name': row['author__last_name'],
+                        'is_subscribed': row['is_author_subscribed'],
+                    }
+            image = row['image']
+            data.append({
+                'id': row['id'],
+                'name': row['name'],
+                'author': author,
+                'image': media_url(image, request) if image else None,
+                'images': image_sizes(image, row['image_variants'], request),
+                'text': row['text'],
+                'tags': tags[row['id']],
+                'cooking_time': row['cooking_time'],
+                'ingredients': ingredients[row['id']],
+                'is_favorited': row['is_favorited'],
+                'is_in_shopping_cart': row['is_in_shopping_cart'],
+            })
+        return data
+
+
+class RowListMixin:
+    """list() через row_serializer_class вместо сериализатора DRF.
+
+    Включается настройкой FAST_RECIPE_LIST. Фильтры, пагинация и кэш
+    ленты работают как прежде: страница выбирается из .values() того же
+    queryset.
+    """
+
+    row_serializer_class = None
+
+    def use_rows(self):
+        return settings.FAST_RECIPE_LIST and (
+            self.row_serializer_class is not None
+        )
+
+    def list_rows(self):
+        serializer = self.row_serializer_class(
+            context=self.get_serializer_context()
+        )
+        queryset = serializer.values(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return response.Response(
+                serializer.to_representation(list(queryset))
+            )
+        return self.get_paginated_response(
+            serializer.to_representation(page)
+        )
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_rows():
+            return super().list(request, *args, **kwargs)
+        return self.list_rows()
+
+    async def alist(self, request, *args, **kwargs):
+        """Страница и её теги с ингредиентами - за один переход в поток."""
+
+        if not self.use_rows():
+            return await super().alist(request, *args, **kwargs)
+        return await sync_to_async(self.list_rows)()
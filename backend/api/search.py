@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import chain
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from .cache import get_model_version
+from .replica import read_from_primary
+from recipe.models import Ingredient
+
+# Верхняя граница для поиска по префиксу в отсортированном массиве строк
+PREFIX_END = chr(0x10FFFF)
+
+
+class IngredientIndex:
+    """Компактный индекс ингредиентов для автодополнения.
+
+    names - названия в нижнем регистре, отсортированные: поиск по префиксу
+    через bisect. Для поиска по вхождению - суффиксный массив: номер
+    названия owners и смещение offsets каждого суффикса, отсортированные
+    по names[owner][offset:]. Сами суффиксы не хранятся, bisect срезает
+    их на лету: 6 байт на символ названий вместо копии каждого суффикса.
+    Больше INGREDIENT_INDEX_MAX_ROWS строк индекс не строится, поиск
+    идёт через базу.
+    """
+
+    __slots__ = ('rows', 'names', 'owners', 'offsets')
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: row['name'].lower())
+        self.names = [row['name'].lower() for row in self.rows]
+        # Суффиксы сортируются по группам первой буквы: в памяти
+        # одновременно только ключи одной группы
+        buckets = defaultdict(list)
+        for owner, name in enumerate(self.names):
+            for offset in range(1, len(name)):
+                buckets[name[offset]].append(owner << 16 | offset)
+        self.owners = array('I')
+        self.offsets = array('H')
+        for first in sorted(buckets):
+            bucket = buckets.pop(first)
+            bucket.sort(key=self._unpacked_suffix)
+            self.owners.extend(position >> 16 for position in bucket)
+            self.offsets.extend(position & 0xFFFF for position in bucket)
+
+    @classmethod
+    def from_db(cls):
+        """Индекс всех ингредиентов, пустой - если их слишком много."""
+
+        limit = settings.INGREDIENT_INDEX_MAX_ROWS
+        with read_from_primary():
+            if Ingredient.objects.order_by().values('pk')[limit:limit + 1]:
+                return cls([])
+            return cls(list(
+                Ingredient.objects.values('id', 'name', 'measurement_unit')
+            ))
+
+    def _unpacked_suffix(self, position):
+        return self.names[position >> 16][position & 0xFFFF:]
+
+    def _suffix(self, position):
+        return self.names[self.owners[position]][self.offsets[position]:]
+
+    def _range(self, keys, value, key=None):
+        return (
+            bisect_left(keys, value, key=key),
+            bisect_left(keys, value + PREFIX_END, key=key),
+        )
+
+    def search(self, value):
+        """Сначала совпадения с начала названия, затем по вхождению."""
+
+        value = value.lower()
+        start, end = self._range(self.names, value)
+        low, high = self._range(
+            range(len(self.owners)), value, key=self._suffix
+        )
+        contains = sorted(
+            {self.owners[position] for position in range(low, high)}
+            - set(range(start, end))
+        )
+        return [
+            self.rows[owner]
+            for owner in chain(range(start, end), contains)
+        ]
+
+
+class IngredientIndexHolder:
+    """Индекс текущего воркера, перестраивается при смене версии модели.
+
+    Версия хранится в общем кэше и проверяется не чаще, чем раз
+    в INGREDIENT_INDEX_CHECK_INTERVAL секунд.
+    """
+
+    __slots__ = ('index', 'version', 'checked', 'lock')
+
+    def __init__(self):
+        self.index = None
+        self.version = None
+        self.checked = 0.0
+        self.lock = Lock()
+
+    def get(self, version=None):
+        """Индекс версии version; без неё версия сверяется по таймеру."""
+
+        now = monotonic()
+        interval = settings.INGREDIENT_INDEX_CHECK_INTERVAL
+        if version is None:
+            if self.index is not None and now - self.checked < interval:
+                return self.index
+            version = get_model_version(Ingredient)
+        if self.index is None or version != self.version:
+            with self.lock:
+                if self.index is None or version != self.version:
+                    self.index = IngredientIndex.from_db()
+                    self.version = version
+        self.checked = now
+        return self.index
+
+    def search(self, value, version=None):
+        return self.get(version).search(value)
+
+
+ingredient_index = IngredientIndexHolder()
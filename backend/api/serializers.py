@@ -1,22 +1,58 @@
+from django.conf import settings
 from django.db.models import F
 from django.db.transaction import atomic
+from djoser import serializers as djoser_serializers
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import (exceptions, relations, serializers, status,
                             validators)
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from .authentication import access_token_for, issuing_token, refresh_token_for
+from .manage.functionality import get_recipes_limit
+from .manage.images import image_sizes, media_url
 from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                           ShoppingCart, Tag)
+                           ShoppingCart, ShoppingCartTotal, Tag)
 from user.models import Subscription, User
 
 
+class ImageUrlField(serializers.ReadOnlyField):
+    """URL картинки для чтения. В отличие от Base64ImageField
+        не тянет за собой декодирование и проверку загрузки.
+    """
+
+    def to_representation(self, image):
+        if not image:
+            return None
+        return media_url(image.name, self.context.get('request'))
+
+
+class ImageSizesField(serializers.ReadOnlyField):
+    """URL, ширина и высота картинки рецепта каждого размера
+        из RECIPE_IMAGE_SIZES.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return image_sizes(
+            recipe.image.name,
+            recipe.image_variants,
+            self.context.get('request'),
+        )
+
+
 class ShowAddedRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор модели Recipe. Короткий, для некоторых эндпоинтов."""
 
-    image = Base64ImageField()
+    image = ImageUrlField()
+    images = ImageSizesField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -71,16 +107,62 @@ class UserSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, author):
         """Проверка подписки пользователей."""
 
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
         request = self.context.get('request')
         return (request and request.user.is_authenticated
                 and request.user.subscriber.filter(author=author).exists())
 
 
+class TokenSerializer(djoser_serializers.TokenSerializer):
+    """Ответ на вход. При STATELESS_AUTH вместо ключа authtoken -
+        подписанный access-токен и refresh-токен для его продления.
+    """
+
+    def to_representation(self, token):
+        if not settings.STATELESS_AUTH:
+            return super().to_representation(token)
+        return {
+            'auth_token': str(access_token_for(token)),
+            'refresh_token': str(refresh_token_for(token)),
+        }
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    """Новый access-токен по refresh-токену.
+        Пользователь читается из базы: в токен попадут свежие данные,
+        неактивный пользователь токен не получит. Refresh-токен годится,
+        пока не удалён ключ authtoken, по которому он выдан при входе.
+    """
+
+    refresh_token = serializers.CharField()
+
+    def validate_refresh_token(self, value):
+        try:
+            token = RefreshToken(value)
+        except TokenError:
+            raise exceptions.ValidationError(
+                'Токен недействителен или просрочен'
+            )
+        self.auth_token = issuing_token(token)
+        if self.auth_token is None:
+            raise exceptions.ValidationError('Выполнен выход, войдите снова')
+        if not self.auth_token.user.is_active:
+            raise exceptions.ValidationError(
+                'Пользователь не найден или неактивен'
+            )
+        return value
+
+    def to_representation(self, instance):
+        return {'auth_token': str(access_token_for(self.auth_token))}
+
+
 class RecipeReadListSerializer(serializers.ModelSerializer):
     """Серилизатор <списка> модели Recipes."""
 
     author = UserSerializer(read_only=True)
-    image = Base64ImageField(read_only=True)
+    image = ImageUrlField()
+    images = ImageSizesField()
     ingredients = IngredientInRecipeSerializer(
         required=True, many=True, source='ingredient_list'
     )
@@ -97,6 +179,7 @@ class RecipeReadListSerializer(serializers.ModelSerializer):
             'name',
             'author',
             'image',
+            'images',
             'text',
             'tags',
             'cooking_time',
@@ -116,9 +199,17 @@ class RecipeReadListSerializer(serializers.ModelSerializer):
             amount=F('recipes__ingredient_list')
         )
 
+    def to_representation(self, instance):
+        if (hasattr(instance, 'is_author_subscribed')
+                and instance.author is not None):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
         """Проверка списка избранного."""
 
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -130,6 +221,8 @@ class RecipeReadListSerializer(serializers.ModelSerializer):
     def get_is_in_shopping_cart(self, obj):
         """Проверка списка покупок."""
 
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
@@ -142,7 +235,7 @@ class RecipeReadListSerializer(serializers.ModelSerializer):
 class IngredientInRecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор ингредиента в рецепте."""
 
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = IngredientInRecipe
@@ -165,14 +258,51 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'name', 'text', 'cooking_time')
         read_only_fields = ('author', 'is_favorited', 'is_in_shopping_cart')
 
-    @atomic
     def creating_ingredients(self, recipe, ingredients_data):
-        for ingredient in ingredients_data:
-            IngredientInRecipe.objects.get_or_create(
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
                 recipe=recipe,
-                ingredient=ingredient['id'],
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             )
+            for ingredient in ingredients_data
+        )
+
+    @atomic
+    def updating_ingredients(self, recipe, ingredients_data):
+        """Записывает только разницу между старыми и новыми ингредиентами.
+            Возвращает прежние количества: {ingredient_id: amount}.
+        """
+
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in existing.items()
+        }
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        removed = existing.keys() - new_amounts.keys()
+        if removed:
+            IngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, row in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        self.creating_ingredients(recipe, (
+            ingredient for ingredient in ingredients_data
+            if ingredient['id'] not in existing
+        ))
+        return old_amounts
 
     @atomic
     def create(self, validated_data):
@@ -189,31 +319,36 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        self.creating_ingredients(instance, ingredients_data)
+        old_amounts = self.updating_ingredients(instance, ingredients_data)
+        ShoppingCartTotal.objects.change_recipe(instance, old_amounts)
         instance.tags.set(tags)
 
         return super().update(instance, validated_data)
 
     def validate_ingredients(self, value):
-        """Проверяем ингредиенты в рецепте."""
+        """Проверяем ингредиенты в рецепте одним запросом к базе."""
 
-        ingredients = self.initial_data.get('ingredients')
-        if len(ingredients) <= 0:
+        if len(value) <= 0:
             raise exceptions.ValidationError(
                 {'ingredients': 'не может быть меньше 0'}
             )
-        ingredients_list = []
-        for item in ingredients:
-            if item['id'] in ingredients_list:
-                raise exceptions.ValidationError(
-                    {'ingredients': 'не может повторятся'}
-                )
-            ingredients_list.append(item['id'])
+        ingredient_ids = [item['id'] for item in value]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise exceptions.ValidationError(
+                {'ingredients': 'не может повторятся'}
+            )
+        for item in value:
             if int(item['amount']) <= 0:
                 raise exceptions.ValidationError(
                     {'amount': 'не может быть меньше 0'}
                 )
+        missing = set(ingredient_ids) - Ingredient.objects.in_bulk(
+            ingredient_ids
+        ).keys()
+        if missing:
+            raise exceptions.ValidationError(
+                {'ingredients': f'не существуют: {sorted(missing)}'}
+            )
 
         return value
 
@@ -221,7 +356,8 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         context = {'request': request}
         return RecipeReadListSerializer(
-            instance, context=context
+            Recipe.objects.with_user_flags(request.user).get(pk=instance.pk),
+            context=context
         ).data
 
 
@@ -258,21 +394,18 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     def get_recipes_count(self, obj):
         """Количество рецептов."""
 
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
         """Рецепты."""
 
-        request = self.context.get('request')
-        limit = request.GET.get('recipe_limit')
-        recipes = obj.recipes.all()
-        if limit == int:
-            try:
-                recipes = recipes[:int(limit)]
-            except ValueError:
-                raise ('\nОжидеется тип даннх integer')
-        # if recipes == recipes[:int(limit)]:
-        #     raise ValueError('\nОжидеется тип даннх integer')
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = ShowAddedRecipeSerializer(
             recipes,
             many=True,
@@ -0,0 +1,1562 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import warnings
+from asyncio import iscoroutinefunction
+from base64 import b64encode, urlsafe_b64encode
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from io import StringIO
+from types import ModuleType
+from unittest import mock, skipUnless
+
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.routers import DefaultRouter
+from rest_framework.test import APIClient
+
+from .cache import (RECIPE_FEED, get_version, user_flags_version,
+                    version_key)
+from .manage import images
+# Роутер из DATABASE_ROUTERS, админка и URL загружают api.replica,
+# api.pagination и api.views, а тесты находятся как backend.api.tests
+# (в backend/ есть __init__.py): относительный импорт дал бы вторые копии
+# модулей
+from api.pagination import CachedCountPaginator
+from api.replica import (REPLICA, ReplicaRouter, pin_key, read_db,
+                         read_from_primary)
+from api.views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                       UserViewset)
+from foodgram.postgresql_pool import base as postgresql_pool
+from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                           RecipeImageVariant, RecipeScore, ShoppingCart,
+                           ShoppingCartTotal, Tag)
+from user.models import Subscription, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+)
+
+
+api_settings = override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    RECIPE_IMAGE_WORKERS=0,
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }},
+)
+
+
+@api_settings
+class RecipeListTestCase(TestCase):
+    """Лента рецептов: число запросов не зависит от размера страницы."""
+
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@foodgram.ru',
+                username=f'user{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password',
+            )
+            for number in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег{number}',
+                slug=f'tag{number}',
+                color=f'#00000{number}',
+            )
+            for number in range(10)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент{number}', measurement_unit='г'
+            )
+            for number in range(6)
+        ]
+        for number in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.users[number % 3],
+                name=f'Рецепт{number}',
+                text='Описание',
+                cooking_time=number + 1,
+                image=SimpleUploadedFile('recipe.gif', GIF),
+            )
+            recipe.tags.set(cls.tags[:1 + number % len(cls.tags)])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient=ingredients[(number + shift) % 6],
+                    amount=shift + 1,
+                )
+                for shift in range(3)
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.users[0], recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.users[0], recipe=recipe)
+        Subscription.objects.create(user=cls.users[0], author=cls.users[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = APIClient()
+        self.authorized_client = APIClient()
+        self.authorized_client.force_authenticate(self.users[0])
+
+    def get_list(self, client, url):
+        cache.clear()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_queries(self):
+        """Число запросов ленты одно для страниц в 2 и 10 рецептов."""
+
+        for client, query, queries in (
+            (self.guest_client, '', 5),
+            (self.authorized_client, '', 8),
+            (self.authorized_client, '&is_in_shopping_cart=1', 5),
+        ):
+            for limit in (2, 10):
+                with self.subTest(query=query, limit=limit, queries=queries):
+                    with self.assertNumQueries(queries):
+                        data = self.get_list(
+                            client, f'/api/recipes/?limit={limit}{query}'
+                        )
+                    self.assertEqual(
+                        len(data['results']), min(limit, data['count'])
+                    )
+
+    def test_tags_filter(self):
+        """Фильтр по 1-10 тегам: число запросов одно и то же, рецепты -
+            все с любым из тегов, каждый один раз.
+        """
+
+        for client, queries in (
+            (self.guest_client, 5),
+            (self.authorized_client, 8),
+        ):
+            for count in range(1, len(self.tags) + 1):
+                tags = self.tags[-count:]
+                query = ''.join(f'&tags={tag.slug}' for tag in tags)
+                with self.subTest(tags=count, queries=queries):
+                    with self.assertNumQueries(queries):
+                        data = self.get_list(
+                            client, f'/api/recipes/?limit=20{query}'
+                        )
+                    ids = [recipe['id'] for recipe in data['results']]
+                    self.assertEqual(len(ids), len(set(ids)))
+                    self.assertEqual(data['count'], len(ids))
+                    self.assertEqual(set(ids), set(
+                        Recipe.objects.filter(tags__in=tags).values_list(
+                            'id', flat=True
+                        )
+                    ))
+
+    def test_cursor_pages(self):
+        """Курсор проходит ленту без пропусков и повторов."""
+
+        ids = []
+        url = '/api/recipes/?limit=5&cursor='
+        while url:
+            data = self.get_list(self.guest_client, url)
+            ids.extend(recipe['id'] for recipe in data['results'])
+            url = data['next']
+        self.assertEqual(
+            ids, list(Recipe.objects.values_list('id', flat=True))
+        )
+
+    def test_forged_cursor(self):
+        """Курсор, который сервер не выдавал, - 404, а не ошибка 500."""
+
+        for ordering in ('', '&ordering=popular'):
+            for position in (
+                ['abc', 'x'],
+                ['2026-01-01', 'x'],
+                [1, 2] if not ordering else ['x', 2],
+                [[1], {}],
+                ['2026-01-01', None],
+                [None, 1],
+                [1],
+                {'id': 1},
+            ):
+                cursor = urlsafe_b64encode(json.dumps(position).encode())
+                with self.subTest(ordering=ordering, position=position):
+                    response = self.guest_client.get(
+                        f'/api/recipes/?cursor={cursor.decode()}{ordering}'
+                    )
+                    self.assertEqual(response.status_code, 404)
+
+    def refresh_scores(self, *args):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_recipe_scores', *args, stdout=StringIO())
+
+    def test_scores_refresh_keeps_feed(self):
+        """Пересчёт рейтингов обновляет ?ordering=popular, но не
+            сбрасывает остальную ленту.
+        """
+
+        self.refresh_scores('--full')
+        self.guest_client.get('/api/recipes/')
+        self.guest_client.get('/api/recipes/?ordering=popular')
+        recipe = Recipe.objects.get(name='Рецепт0')
+        for user in self.users[1:]:
+            Favorite.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.refresh_scores()
+        with self.assertNumQueries(0):
+            self.guest_client.get('/api/recipes/')
+        data = self.guest_client.get('/api/recipes/?ordering=popular').json()
+        self.assertEqual(data['results'][0]['id'], recipe.id)
+
+    def test_ordering_without_score(self):
+        """Рецепт без строки рейтинга (вставлен в обход сигналов)
+            получает её при пересчёте и остаётся в ?ordering=.
+        """
+
+        recipe = Recipe.objects.get(name='Рецепт0')
+        RecipeScore.objects.filter(recipe=recipe).delete()
+        self.refresh_scores()
+        for ordering in ('popular', 'trending'):
+            data = self.guest_client.get(
+                f'/api/recipes/?ordering={ordering}&limit=20'
+            ).json()
+            self.assertIn(recipe.id, [item['id'] for item in data['results']])
+            self.assertEqual(data['count'], self.recipes_count)
+
+    def test_ordering_count(self):
+        """Количество для ?ordering= считается без JOIN с рейтингами
+            и совпадает с числом рецептов на страницах.
+        """
+
+        self.refresh_scores()
+        for client, query in (
+            (self.guest_client, 'ordering=popular'),
+            (self.guest_client, 'ordering=trending&tags=tag5&tags=tag9'),
+            (self.authorized_client, 'ordering=popular&is_favorited=1'),
+        ):
+            with self.subTest(query=query):
+                cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    data = client.get(f'/api/recipes/?{query}&limit=20').json()
+                counts = [
+                    item['sql'] for item in context.captured_queries
+                    if 'COUNT(' in item['sql'].upper()
+                ]
+                self.assertEqual(len(counts), 1, counts)
+                self.assertNotIn('recipe_recipescore', counts[0])
+                self.assertEqual(data['count'], len(data['results']))
+
+    def test_detail_flags(self):
+        """Флаги рецепта приходят аннотациями Exists в запросе рецепта:
+            число запросов одно для любых значений флагов.
+        """
+
+        for number in range(6):
+            recipe = Recipe.objects.get(name=f'Рецепт{number}')
+            with self.subTest(recipe=recipe.name), self.assertNumQueries(4):
+                data = self.get_list(
+                    self.authorized_client, f'/api/recipes/{recipe.id}/'
+                )
+            self.assertEqual(data['is_favorited'], bool(number % 2))
+            self.assertEqual(data['is_in_shopping_cart'], bool(number % 3))
+            self.assertEqual(
+                data['author']['is_subscribed'], number % 3 == 1
+            )
+
+    def test_list_flags(self):
+        """Флаги пользователя в ленте совпадают с данными в базе."""
+
+        data = self.get_list(self.authorized_client, '/api/recipes/?limit=20')
+        for recipe in data['results']:
+            self.assertEqual(
+                recipe['is_favorited'],
+                Favorite.objects.filter(
+                    user=self.users[0], recipe_id=recipe['id']
+                ).exists()
+            )
+            self.assertEqual(
+                recipe['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(
+                    user=self.users[0], recipe_id=recipe['id']
+                ).exists()
+            )
+            self.assertEqual(
+                recipe['author']['is_subscribed'],
+                recipe['author']['id'] == self.users[1].id
+            )
+
+
+def async_read_urls():
+    """URL API с ViewSet, собранными при ASYNC_READ_VIEWS: as_view()
+        читает настройку при сборке, api.urls собран без неё.
+    """
+
+    router = DefaultRouter()
+    for prefix, viewset in (
+        ('users', UserViewset),
+        ('tags', TagViewSet),
+        ('recipes', RecipeViewSet),
+        ('ingredients', IngredientViewSet),
+    ):
+        router.register(prefix, viewset, basename=prefix)
+    urls = ModuleType('async_read_urls')
+    with override_settings(ASYNC_READ_VIEWS=True):
+        urls.urlpatterns = [path('api/', include(router.urls))]
+    return urls
+
+
+@api_settings
+class AsyncReadTestCase(TestCase):
+    """GET через AsyncReadMixin под ASGI отдаёт то же, что под WSGI."""
+
+    # Данные - как в ленте рецептов
+    recipes_count = RecipeListTestCase.recipes_count
+    setUpTestData = classmethod(RecipeListTestCase.setUpTestData.__func__)
+
+    URLS = (
+        '/api/recipes/',
+        '/api/recipes/?page=2&limit=5',
+        '/api/recipes/?is_favorited=1',
+        '/api/recipes/?is_in_shopping_cart=1&tags=tag1',
+        '/api/recipes/?ordering=popular',
+        '/api/recipes/{recipe}/',
+        '/api/recipes/0/',
+        '/api/tags/',
+        '/api/tags/{tag}/',
+        '/api/ingredients/?name=ингредиент1',
+        '/api/ingredients/{ingredient}/',
+        '/api/users/',
+        '/api/users/{author}/',
+        '/api/users/subscriptions/?recipes_limit=2',
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(
+            override_settings(ROOT_URLCONF=async_read_urls())
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def sync_get(self, url, headers):
+        cache.clear()
+        response = APIClient().get(url, headers=headers)
+        return response.status_code, response.json()
+
+    async def test_same_payload(self):
+        """Аноним и пользователь: список, фильтры, объект, 404."""
+
+        token = await Token.objects.acreate(user=self.users[0])
+        recipe = await Recipe.objects.order_by('id').alast()
+        ids = {
+            'recipe': recipe.id,
+            'tag': self.tags[1].id,
+            'ingredient': (await Ingredient.objects.afirst()).id,
+            'author': self.users[1].id,
+        }
+        client = AsyncClient()
+        for headers in ({}, {'Authorization': f'Token {token.key}'}):
+            for url in self.URLS:
+                url = url.format(**ids)
+                with self.subTest(url=url, user=bool(headers)):
+                    func = resolve(url.split('?')[0]).func
+                    self.assertTrue(iscoroutinefunction(func))
+                    expected = await sync_to_async(self.sync_get)(
+                        url, headers
+                    )
+                    await sync_to_async(cache.clear)()
+                    response = await client.get(url, headers=headers)
+                    self.assertEqual(
+                        (response.status_code, response.json()), expected
+                    )
+
+
+@api_settings
+class RecipeRowsTestCase(TestCase):
+    """Лента из RecipeRowSerializer побайтно совпадает с лентой из
+        RecipeReadListSerializer.
+    """
+
+    queries = (
+        '',
+        '?limit=3',
+        '?limit=3&page=2',
+        '?limit=2&cursor=',
+        '?ordering=popular',
+        '?is_favorited=1',
+        '?is_in_shopping_cart=1',
+        '?tags=soup&tags=salad',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, author, gone = (
+            User.objects.create_user(
+                email=f'{name}@foodgram.ru',
+                username=name,
+                first_name='Имя "в кавычках"',
+                last_name='Фамилия',
+                password='password',
+            )
+            for name in ('viewer', 'author', 'gone')
+        )
+        soup, salad, _ = (
+            Tag.objects.create(name=name, slug=slug, color=color)
+            for name, slug, color in (
+                ('Суп', 'soup', '#FF0000'),
+                ('Салат', 'salad', '#00FF00'),
+                ('Пустой', 'empty', '#0000FF'),
+            )
+        )
+        salt, water = (
+            Ingredient.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('Соль', 'г'), ('Вода', 'мл'))
+        )
+        recipes = []
+        for number, (owner, tags, ingredients) in enumerate((
+            (author, (soup, salad), ((salt, 5), (water, 300))),
+            (author, (), ()),
+            (gone, (salad,), ((water, 1),)),
+            (cls.viewer, (soup,), ((salt, 1),)),
+            (author, (salad, soup), ((water, 2), (salt, 3))),
+        )):
+            # Размеры готовы только у картинок чётных рецептов
+            with cls.captureOnCommitCallbacks(execute=number % 2 == 0):
+                recipe = Recipe.objects.create(
+                    author=owner,
+                    name=f'Рецепт "{number}" \\ №{number}',
+                    text='Строка\nи ещё одна\t</script>',
+                    cooking_time=number + 1,
+                    image=SimpleUploadedFile('recipe.gif', GIF),
+                )
+            recipe.tags.set(tags)
+            for ingredient, amount in ingredients:
+                IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+            recipes.append(recipe)
+        gone.delete()
+        for recipe in recipes[::2]:
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+        for recipe in recipes[1:3]:
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+        Subscription.objects.create(user=cls.viewer, author=author)
+        call_command('refresh_recipe_scores', '--full', stdout=StringIO())
+
+    def get(self, client, url, fast):
+        cache.clear()
+        with override_settings(FAST_RECIPE_LIST=fast):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_same_payload(self):
+        guest_client = APIClient()
+        authorized_client = APIClient()
+        authorized_client.force_authenticate(self.viewer)
+        for client in (guest_client, authorized_client):
+            for query in self.queries:
+                url = f'/api/recipes/{query}'
+                with self.subTest(user=client is authorized_client, url=url):
+                    self.assertEqual(
+                        self.get(client, url, fast=True),
+                        self.get(client, url, fast=False),
+                    )
+
+    def test_check_recipe_rows(self):
+        """Команда для проверки на живой базе согласна с тестом."""
+
+        for user in (None, self.viewer.id):
+            call_command(
+                'check_recipe_rows',
+                '--page-size', '2',
+                *(('--user', str(user)) if user else ()),
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+
+
+@api_settings
+class ShoppingListTestCase(TestCase):
+    """Выгрузка <списка покупок>: ETag меняется вместе с файлом."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@foodgram.ru',
+            username='cook',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент{number}', measurement_unit='г'
+            )
+            for number in range(2)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.user,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=5,
+            image=SimpleUploadedFile('recipe.gif', GIF),
+        )
+        cls.recipe.tags.set([cls.tag])
+        for ingredient, amount in zip(cls.ingredients, (2, 3)):
+            IngredientInRecipe.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=amount
+            )
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, etag=None):
+        headers = {} if etag is None else {'HTTP_IF_NONE_MATCH': etag}
+        return self.client.get(self.url, **headers)
+
+    def download_changed(self, etag):
+        response = self.download(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return b''.join(response.streaming_content).decode()
+
+    def download_content(self, url):
+        return b''.join(self.client.get(url).streaming_content)
+
+    def test_not_modified(self):
+        """Повторная выгрузка с тем же ETag - 304 без запросов к базе."""
+
+        etag = self.download()['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.download(etag).status_code, 304)
+
+    def test_swapped_amounts(self):
+        """Обмен количеств не меняет сумму, но меняет файл и ETag."""
+
+        etag = self.download()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {
+                    'tags': [self.tag.id],
+                    'ingredients': [
+                        {'id': self.ingredients[0].id, 'amount': 3},
+                        {'id': self.ingredients[1].id, 'amount': 2},
+                    ],
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Ингредиент0 (г) - 3', self.download_changed(etag))
+
+    def test_renamed_ingredient(self):
+        etag = self.download()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(pk=self.ingredients[0].pk).update(
+                name='Сахар'
+            )
+        self.assertIn('Сахар', self.download_changed(etag))
+
+    def test_other_buyer(self):
+        """Правка рецепта меняет ETag каждого покупателя, изменения
+            в чужом <списке покупок> - нет.
+        """
+
+        buyer = User.objects.create_user(
+            email='buyer@foodgram.ru',
+            username='buyer',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        ShoppingCart.objects.create(user=buyer, recipe=self.recipe)
+        self.client.force_authenticate(buyer)
+        etag = self.download()['ETag']
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(
+                f'/api/recipes/{self.recipe.id}/shopping_cart/'
+            )
+        self.assertEqual(response.status_code, 204)
+        self.client.force_authenticate(buyer)
+        self.assertEqual(self.download(etag).status_code, 304)
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {
+                    'tags': [self.tag.id],
+                    'ingredients': [
+                        {'id': self.ingredients[1].id, 'amount': 3},
+                    ],
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(buyer)
+        self.assertNotIn('Ингредиент0', self.download_changed(etag))
+
+    async def test_asgi_stream(self):
+        """Под ASGI файл отдаётся асинхронным итератором, без сборки
+            в памяти, и совпадает с выгрузкой под WSGI.
+        """
+
+        client = AsyncClient()
+        headers = {'Authorization': f'Token {self.token.key}'}
+        for format in ('txt', 'csv', 'json'):
+            with self.subTest(format=format):
+                url = f'{self.url}?format={format}'
+                expected = await sync_to_async(self.download_content)(url)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error')
+                    response = await client.get(url, headers=headers)
+                    self.assertTrue(response.is_async)
+                    content = b''.join([
+                        chunk async for chunk in response.streaming_content
+                    ])
+                self.assertEqual(content, expected)
+
+
+@api_settings
+class RecipeWriteTestCase(TestCase):
+    """Запись рецепта: число запросов не зависит от числа ингредиентов,
+        ошибки в ингредиентах - 400.
+    """
+
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@foodgram.ru',
+            username='cook',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент{number}', measurement_unit='г')
+            for number in range(60)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, name='Рецепт'):
+        return {
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': 'data:image/gif;base64,' + b64encode(GIF).decode(),
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient, amount in ingredients
+            ],
+        }
+
+    def create(self, ingredients, name='Рецепт'):
+        response = self.client.post(
+            self.url, self.payload(ingredients, name), format='json'
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_create_queries(self):
+        for count in (1, 30):
+            with self.subTest(count=count), self.assertNumQueries(15):
+                self.create(
+                    ((ingredient, 1) for ingredient
+                     in self.ingredients[:count]),
+                    f'Рецепт{count}',
+                )
+
+    def test_update_queries(self):
+        """Половина ингредиентов меняет количество, четверть удаляется,
+            столько же добавляется.
+        """
+
+        for count in (4, 40):
+            recipe_id = self.create(
+                ((ingredient, 1) for ingredient in self.ingredients[:count]),
+                f'Рецепт{count}',
+            )
+            kept = self.ingredients[count // 4:count]
+            added = self.ingredients[count:count + count // 4]
+            ingredients = [
+                (ingredient, 1 + number % 2)
+                for number, ingredient in enumerate(kept)
+            ] + [(ingredient, 3) for ingredient in added]
+            cache.clear()
+            with self.subTest(count=count), self.assertNumQueries(25):
+                response = self.client.patch(
+                    f'{self.url}{recipe_id}/',
+                    self.payload(ingredients, f'Рецепт{count}'),
+                    format='json',
+                )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                dict(IngredientInRecipe.objects.filter(
+                    recipe_id=recipe_id
+                ).values_list('ingredient_id', 'amount')),
+                {ingredient.id: amount for ingredient, amount in ingredients},
+            )
+
+    def test_invalid_ingredients(self):
+        first, second = self.ingredients[:2]
+        unknown = Ingredient(id=self.ingredients[-1].id + 1)
+        for ingredients in (
+            [(first, 1), (unknown, 1)],
+            [(first, 1), (second, 1), (first, 2)],
+        ):
+            with self.subTest(ingredients=ingredients):
+                response = self.client.post(
+                    self.url, self.payload(ingredients), format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+
+
+@api_settings
+class ShoppingCartTotalTestCase(TestCase):
+    """Итоги <списков покупок> сходятся с пересчётом после правок
+        рецепта через API и через админку.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_superuser(
+            email='author@foodgram.ru',
+            username='author',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        cls.buyers = [
+            User.objects.create_user(
+                email=f'buyer{number}@foodgram.ru',
+                username=f'buyer{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password',
+            )
+            for number in range(2)
+        ]
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент{number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        cls.recipe, cls.other = (
+            Recipe.objects.create(
+                author=cls.author,
+                name=name,
+                text='Описание',
+                cooking_time=5,
+                image=SimpleUploadedFile('recipe.gif', GIF),
+            )
+            for name in ('Рецепт', 'Другой')
+        )
+        for recipe, amounts in ((cls.recipe, (2, 3)), (cls.other, (5,))):
+            recipe.tags.set([cls.tag])
+            for ingredient, amount in zip(cls.ingredients, amounts):
+                IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+        ShoppingCart.objects.create(user=cls.buyers[0], recipe=cls.other)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assert_consistent(self):
+        user_ids = [self.author.id] + [user.id for user in self.buyers]
+        self.assertEqual(
+            {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingCartTotal.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                )
+            },
+            ShoppingCartTotal.objects.calculate(user_ids),
+        )
+
+    def admin_change(self, amounts):
+        """Сохраняет рецепт в админке с ингредиентами {ingredient: amount},
+            прочие ингредиенты рецепта удаляются.
+        """
+
+        rows = list(self.recipe.ingredient_list.all())
+        data = {
+            'name': self.recipe.name,
+            'author': self.author.id,
+            'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time,
+            'tags': [self.tag.id],
+            'ingredient_list-TOTAL_FORMS': len(rows) + len(amounts),
+            'ingredient_list-INITIAL_FORMS': len(rows),
+            'ingredient_list-MIN_NUM_FORMS': 1,
+            'ingredient_list-MAX_NUM_FORMS': 1000,
+        }
+        amounts = dict(amounts)
+        forms = [
+            (row.id, row.ingredient, amounts.pop(row.ingredient, None))
+            for row in rows
+        ] + [
+            ('', ingredient, amount) for ingredient, amount in amounts.items()
+        ]
+        for number, (row_id, ingredient, amount) in enumerate(forms):
+            prefix = f'ingredient_list-{number}-'
+            data.update({
+                f'{prefix}id': row_id,
+                f'{prefix}recipe': self.recipe.id,
+                f'{prefix}ingredient': ingredient.id,
+                f'{prefix}amount': amount or 1,
+            })
+            if amount is None:
+                data[f'{prefix}DELETE'] = 'on'
+        self.client.force_login(self.author)
+        response = self.client.post(
+            f'/admin/recipe/recipe/{self.recipe.id}/change/', data
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_api_and_admin_edits(self):
+        first, second, third = self.ingredients
+        for buyer in self.buyers:
+            response = self.client_for(buyer).post(
+                f'/api/recipes/{self.recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201)
+        self.assert_consistent()
+
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': first.id, 'amount': 4},
+                    {'id': third.id, 'amount': 1},
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_consistent()
+
+        self.admin_change({first: 1, second: 7})
+        self.assertEqual(
+            dict(self.recipe.ingredient_list.values_list(
+                'ingredient', 'amount'
+            )),
+            {first.id: 1, second.id: 7},
+        )
+        self.assert_consistent()
+
+        response = self.client_for(self.buyers[1]).delete(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_consistent()
+
+
+@api_settings
+class AdminChangelistTestCase(TestCase):
+    """Списки админки считают строки одним COUNT(*) через
+        CachedCountPaginator, счётчики берутся из колонок.
+    """
+
+    URLS = (
+        '/admin/recipe/recipe/',
+        '/admin/recipe/favorite/',
+        '/admin/user/user/',
+        '/admin/user/subscription/',
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            email='admin@foodgram.ru',
+            username='admin',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, start, count):
+        """Авторы с рецептом в <избранном> и подписчиком-админом."""
+
+        for number in range(start, start + count):
+            author = User.objects.create_user(
+                email=f'cook{number}@foodgram.ru',
+                username=f'cook{number}',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password',
+            )
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f'Рецепт{number}',
+                text='Описание',
+                cooking_time=5,
+                image=SimpleUploadedFile('recipe.gif', GIF),
+            )
+            Favorite.objects.create(user=self.admin, recipe=recipe)
+            Subscription.objects.create(user=self.admin, author=author)
+
+    def changelist(self, url):
+        """Число запросов и COUNT(*) при открытии списка."""
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        cl = response.context['cl']
+        self.assertIsInstance(cl.paginator, CachedCountPaginator)
+        self.assertFalse(cl.show_full_result_count)
+        counts = [
+            query['sql'] for query in context.captured_queries
+            if 'COUNT(' in query['sql'].upper()
+        ]
+        return len(context.captured_queries), counts
+
+    def test_single_count(self):
+        """Один COUNT(*) на список, число запросов не зависит от строк."""
+
+        self.add_rows(0, 2)
+        before = {url: self.changelist(url) for url in self.URLS}
+        self.add_rows(2, 3)
+        for url in self.URLS:
+            with self.subTest(url=url):
+                queries, counts = self.changelist(url)
+                self.assertEqual(len(counts), 1, counts)
+                self.assertEqual(queries, before[url][0])
+
+    def test_counters(self):
+        """Счётчики в списке - значения колонок."""
+
+        self.add_rows(0, 1)
+        recipe = Recipe.objects.get()
+        response = self.client.get('/admin/recipe/recipe/')
+        self.assertEqual(
+            response.context['cl'].result_list[0].favorites_count,
+            recipe.favorites_count,
+        )
+        self.assertEqual(recipe.favorites_count, 1)
+        response = self.client.get(
+            '/admin/user/user/', {'q': recipe.author.email}
+        )
+        author = response.context['cl'].result_list[0]
+        self.assertEqual(
+            (author.recipes_count, author.subscribers_count), (1, 1)
+        )
+
+
+@api_settings
+class CacheVersionTestCase(TestCase):
+    """Вытесненная версия не возвращает записи, закэшированные под ней."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.user = User.objects.create_user(
+            email='cook@foodgram.ru',
+            username='cook',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user,
+            name='Каша',
+            text='Описание',
+            cooking_time=5,
+            image=SimpleUploadedFile('recipe.gif', GIF),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_fresh(self, url, version, read, value):
+        """read(ответ) равно value и после вытеснения версии."""
+
+        self.assertEqual(read(self.client.get(url).json()), value)
+        cache.delete(version_key(version))
+        self.assertEqual(read(self.client.get(url).json()), value)
+
+    def test_evicted_tag_version(self):
+        self.client.get('/api/tags/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Ужин'
+            self.tag.save()
+        self.assert_fresh(
+            '/api/tags/', 'recipe.tag', lambda data: data[0]['name'], 'Ужин'
+        )
+
+    def test_evicted_feed_version(self):
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Омлет'
+            self.recipe.save()
+        self.assert_fresh(
+            '/api/recipes/',
+            RECIPE_FEED,
+            lambda data: data['results'][0]['name'],
+            'Омлет',
+        )
+
+    def test_evicted_user_flags_version(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/recipes/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+        self.assert_fresh(
+            '/api/recipes/',
+            user_flags_version(self.user.id),
+            lambda data: data['results'][0]['is_favorited'],
+            True,
+        )
+
+    def test_author_changed(self):
+        """Ленту сбрасывают только поля автора, показанные в ней."""
+
+        version = get_version(RECIPE_FEED)
+        with self.captureOnCommitCallbacks(execute=True):
+            reader = User.objects.create_user(
+                email='reader@foodgram.ru',
+                username='reader',
+                first_name='Имя',
+                last_name='Фамилия',
+                password='password',
+            )
+            reader = User.objects.get(pk=reader.pk)
+            reader.first_name = 'Читатель'
+            reader.save()
+            author = User.objects.get(pk=self.user.pk)
+            author.last_login = timezone.now()
+            author.save(update_fields=('last_login',))
+            author.set_password('secret')
+            author.save()
+        self.assertEqual(get_version(RECIPE_FEED), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            author.first_name = 'Повар'
+            author.save()
+        self.assertNotEqual(get_version(RECIPE_FEED), version)
+
+
+@api_settings
+class IngredientSearchTestCase(TestCase):
+    """Поиск ингредиентов по индексу в памяти совпадает с поиском
+        запросом к базе на данных generate_dataset.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_dataset', recipes=30, users=3, ingredients=1200,
+            seed=1, stdout=StringIO(),
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, value):
+        response = self.client.get('/api/ingredients/', {'name': value})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()]
+
+    def test_index_matches_database(self):
+        """Префикс, вхождение и ничего не найдено."""
+
+        for value in ('ингредиент11', 'ИнГр', 'дие', '117', '0', 'ент99',
+                      'нет такого'):
+            with self.subTest(value=value):
+                found = self.search(value)
+                cache.clear()
+                with mock.patch(
+                    'api.search.IngredientIndexHolder.search',
+                    return_value=[],
+                ) as index_search:
+                    self.assertEqual(found, self.search(value))
+                index_search.assert_called_once()
+                if value != 'нет такого':
+                    self.assertTrue(found)
+
+    def test_prefix_first(self):
+        """Совпадения с начала названия идут перед вхождениями."""
+
+        for name in ('морская соль', 'соль каменная', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+        names = dict(Ingredient.objects.values_list('id', 'name'))
+        self.assertEqual(
+            [names[pk] for pk in self.search('сол')],
+            ['соль', 'соль каменная', 'морская соль'],
+        )
+
+
+@api_settings
+class RecipeImageTestCase(TestCase):
+    """Обработка картинок: замена картинки и сломанный пул процессов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@foodgram.ru',
+            username='cook',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        if images.pool is not None:
+            images.pool.shutdown()
+            images.pool = None
+
+    @override_settings(MEDIA_GARBAGE_GRACE=0)
+    def test_replaced_before_processing(self):
+        """Картинка, заменённая до готовности размеров, удаляется."""
+
+        # Коллбэки коммита не выполняются: размеры первой картинки
+        # не готовы, image_variants пуст
+        recipe = Recipe.objects.create(
+            author=self.user,
+            name='Рецепт',
+            text='Описание',
+            cooking_time=5,
+            image=SimpleUploadedFile('recipe.gif', GIF),
+        )
+        first = recipe.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {
+                    'tags': [self.tag.id],
+                    'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                    'image': 'data:image/gif;base64,'
+                    + b64encode(GIF.replace(b'\xff', b'\xfe')).decode(),
+                },
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assertNotEqual(recipe.image.name, first)
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        self.assertFalse(images.storage.exists(first))
+        self.assertTrue(images.storage.exists(recipe.image.name))
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                author=self.user,
+                name='Рецепт',
+                text='Описание',
+                cooking_time=5,
+                image=SimpleUploadedFile('recipe.gif', GIF),
+            )
+
+    def test_variants_referenced(self):
+        """Ссылки на размеры ищутся по индексированной таблице."""
+
+        recipe = self.create_recipe()
+        variants = recipe.image_files.all()
+        self.assertEqual(
+            {variant.name for variant in variants},
+            {
+                variant['name']
+                for variant in Recipe.objects.get(
+                    pk=recipe.pk
+                ).image_variants['sizes'].values()
+            },
+        )
+        for variant in variants:
+            with self.assertNumQueries(2):
+                self.assertTrue(images.is_referenced(variant.name))
+        recipe.delete()
+        self.assertFalse(RecipeImageVariant.objects.exists())
+
+    def test_deferred_files_collected(self):
+        """Файлы, оставленные из-за MEDIA_GARBAGE_GRACE, позже удаляет
+            collect_media_garbage.
+        """
+
+        recipe = self.create_recipe()
+        names = images.image_files(
+            recipe.image.name,
+            Recipe.objects.get(pk=recipe.pk).image_variants,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertTrue(all(map(images.storage.exists, names)))
+        call_command('collect_media_garbage', grace=0, stdout=StringIO())
+        self.assertFalse(any(map(images.storage.exists, names)))
+
+    def test_saved_while_collected(self):
+        """Файл, сохранённый заново во время проверки ссылок, остаётся."""
+
+        name = images.storage.save('recipe/recipe.gif', ContentFile(GIF))
+        path = images.storage.path(name)
+        os.utime(path, (0, 0))
+
+        def save_again(checked):
+            images.storage.save('recipe/recipe.gif', ContentFile(GIF))
+            return False
+
+        with mock.patch.object(images, 'is_referenced', save_again):
+            self.assertFalse(images.delete_unused(name, grace=0))
+        self.assertTrue(images.storage.exists(name))
+        self.assertFalse(os.path.exists(f'{path}.trash'))
+        self.assertTrue(images.delete_unused(name, grace=0))
+        self.assertFalse(images.storage.exists(name))
+
+    @override_settings(RECIPE_IMAGE_WORKERS=1)
+    def test_broken_pool(self):
+        """Погибший процесс пула не ломает следующие загрузки."""
+
+        images.pool = ProcessPoolExecutor(max_workers=1)
+        with self.assertRaises(BrokenProcessPool):
+            images.pool.submit(os._exit, 1).result()
+        with self.assertLogs(images.logger, 'WARNING'):
+            future = images.submit_to_pool(pow, 2, 3)
+        self.assertEqual(future.result(timeout=60), 8)
+
+
+@api_settings
+class LoadIngredientsTestCase(TestCase):
+    """Загрузка ингредиентов командой load_ingredients."""
+
+    def load(self, *args):
+        call_command('load_ingredients', *args, stdout=StringIO())
+
+    def test_default_path(self):
+        """Без аргументов читается data/ingredients.csv репозитория."""
+
+        self.load()
+        with open(
+            os.path.join(settings.DATA_DIR, 'ingredients.csv'),
+            encoding='utf-8',
+            newline='',
+        ) as file:
+            names = {row[0].strip() for row in csv.reader(file) if row}
+        self.assertEqual(Ingredient.objects.count(), len(names))
+
+    def test_malformed_array_item(self):
+        """Битый объект массива JSON - ошибка, а не чтение до конца
+            файла.
+        """
+
+        items = ', '.join(
+            ['{"name": "Соль", "measurement_unit": "г"}', '{"name": oops}']
+            + ['{"name": "Вода", "measurement_unit": "мл"}'] * 1000
+        )
+        with tempfile.NamedTemporaryFile(
+            'w', suffix='.json', encoding='utf-8'
+        ) as file:
+            file.write(f'[{items}]')
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'Объект 2'):
+                self.load(
+                    file.name, '--chunk-size', '64', '--max-item-size', '256'
+                )
+
+
+@api_settings
+class ReplicaRouterTestCase(TransactionTestCase):
+    """Маршрутизация чтения в реплику на отдельной тестовой базе.
+
+    Реплика здесь - вторая база со своей схемой и своими данными, а не
+    TEST MIRROR основной: по ответу видно, из какой базы он собран.
+    Алиас добавляется на время класса, поэтому databases задаётся здесь,
+    а не атрибутом: иначе раннер ищет реплику до её создания.
+    TransactionTestCase: внутри транзакции основной базы роутер
+    реплику не выбирает.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        default = connections[DEFAULT_DB_ALIAS].settings_dict
+        replica = {
+            **default,
+            'TEST': {
+                'NAME': None if connection.vendor == 'sqlite'
+                else f'{default["NAME"]}_replica',
+            },
+        }
+        cls.replica_settings = override_settings(
+            DATABASES={**settings.DATABASES, REPLICA: replica}
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            cls.replica_settings.enable()
+        connections.settings = connections.configure_settings(
+            {**connections.settings, REPLICA: replica}
+        )
+        # Схему реплике обычно даёт основная база, здесь - миграции
+        with mock.patch.object(
+            ReplicaRouter, 'allow_migrate', return_value=None
+        ):
+            cls.replica_name = connections[REPLICA].creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+        # flush реплику не очищает: роутер не даёт ей миграций
+        User.objects.db_manager(REPLICA).create_user(
+            email='replica@foodgram.ru',
+            username='replica',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        Tag.objects.using(REPLICA).create(name='Реплика', slug='replica')
+        cls.databases = {DEFAULT_DB_ALIAS, REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].creation.destroy_test_db(
+            cls.replica_name, verbosity=0
+        )
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        cls.replica_settings.disable()
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='primary@foodgram.ru',
+            username='primary',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+        Tag.objects.create(name='Основная', slug='primary')
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def usernames(self, client):
+        response = client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']]
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Tag))
+        token = read_db.set(REPLICA)
+        try:
+            self.assertEqual(router.db_for_read(Tag), REPLICA)
+            self.assertEqual(router.db_for_write(Tag), DEFAULT_DB_ALIAS)
+            with read_from_primary():
+                self.assertIsNone(router.db_for_read(Tag))
+                self.assertEqual(
+                    list(Tag.objects.values_list('slug', flat=True)),
+                    ['primary'],
+                )
+            self.assertEqual(router.db_for_read(Tag), REPLICA)
+            self.assertEqual(
+                list(Tag.objects.values_list('slug', flat=True)),
+                ['replica'],
+            )
+        finally:
+            read_db.reset(token)
+
+    def test_reads_from_replica(self):
+        """Список пользователей - из реплики, аутентификация и общий
+            кэш тегов - из основной базы.
+        """
+
+        self.assertEqual(self.usernames(self.client), ['replica'])
+        self.assertEqual(self.usernames(APIClient()), ['replica'])
+        response = self.client.get('/api/tags/')
+        self.assertEqual(
+            [tag['slug'] for tag in response.json()], ['primary']
+        )
+
+    def test_read_your_writes(self):
+        """Изменяющий запрос пишет в основную базу и закрепляет за ней
+            чтение автора, остальные читают реплику.
+        """
+
+        response = self.client.patch(
+            '/api/users/me/', {'first_name': 'Повар'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'Повар')
+        self.assertFalse(
+            User.objects.using(REPLICA).filter(first_name='Повар').exists()
+        )
+        self.assertEqual(self.usernames(self.client), ['primary'])
+        self.assertEqual(self.usernames(APIClient()), ['replica'])
+        cache.delete(pin_key(self.user.id))
+        self.assertEqual(self.usernames(self.client), ['replica'])
+
+
+@api_settings
+@override_settings(STATELESS_AUTH=True)
+class StatelessAuthTestCase(TestCase):
+    """Вход по JWT: выход отзывает токены для изменений и продления."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@foodgram.ru',
+            username='cook',
+            first_name='Имя',
+            last_name='Фамилия',
+            password='password',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            '/api/auth/token/login/',
+            {'email': 'cook@foodgram.ru', 'password': 'password'},
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data['auth_token'], response.data['refresh_token']
+
+    def rename(self, access, name):
+        return self.client.patch(
+            '/api/users/me/', {'first_name': name},
+            HTTP_AUTHORIZATION=f'Token {access}',
+        )
+
+    def refresh(self, refresh):
+        return self.client.post(
+            '/api/auth/token/refresh/', {'refresh_token': refresh}
+        )
+
+    def test_refresh(self):
+        access, refresh = self.login()
+        self.assertEqual(self.rename(access, 'Повар').status_code, 200)
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/api/users/me/',
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['first_name'], 'Повар')
+
+    def test_logout_revokes(self):
+        access, refresh = self.login()
+        response = self.client.post(
+            '/api/auth/token/logout/', HTTP_AUTHORIZATION=f'Token {access}'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.rename(access, 'Повар').status_code, 401)
+        self.assertEqual(self.refresh(refresh).status_code, 400)
+        # Новый вход не оживляет токены прошлого
+        new_access, new_refresh = self.login()
+        self.assertEqual(self.rename(access, 'Повар').status_code, 401)
+        self.assertEqual(self.refresh(refresh).status_code, 400)
+        self.assertEqual(self.rename(new_access, 'Повар').status_code, 200)
+        self.assertEqual(self.refresh(new_refresh).status_code, 200)
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    """Пул соединений foodgram.postgresql_pool."""
+
+    def test_pool_per_params(self):
+        """Смена параметров подключения алиаса - другой пул."""
+
+        settings_dict = {'POOL': {'SIZE': 1}}
+        pool = postgresql_pool.get_pool(
+            'pool_test', {'database': 'foodgram'}, settings_dict
+        )
+        self.assertIs(
+            postgresql_pool.get_pool(
+                'pool_test', {'database': 'foodgram'}, settings_dict
+            ),
+            pool,
+        )
+        self.assertIsNot(
+            postgresql_pool.get_pool(
+                'pool_test', {'database': 'test_foodgram'}, settings_dict
+            ),
+            pool,
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'нужен PostgreSQL')
+    def test_reset_autocommit(self):
+        """Соединение, возвращённое без autocommit, выдаётся с ним."""
+
+        pool = postgresql_pool.ConnectionPool(size=1, timeout=1)
+        connect = partial(
+            psycopg2.connect, **connection.get_connection_params()
+        )
+        first = pool.get(connect)
+        first.autocommit = False
+        with first.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        pool.put(first)
+        second = pool.get(connect)
+        try:
+            self.assertIs(second, first)
+            self.assertTrue(second.autocommit)
+        finally:
+            second.close()
+            pool.put(second)
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import TagViewSet, IngredientViewSet, RecipeViewSet, UserViewset
+from .views import (TagViewSet, IngredientViewSet, RecipeViewSet,
+                    TokenRefreshView, UserViewset)
 
 app_name = 'api'
 
@@ -15,5 +16,10 @@ router.register('ingredients', IngredientViewSet, basename='ingredients')
 urlpatterns = [
     path('', include(router.urls)),
     path('api/', include('djoser.urls')),
+    path(
+        'auth/token/refresh/',
+        TokenRefreshView.as_view(),
+        name='token_refresh'
+    ),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,30 +1,54 @@
-from django.db.models import Sum
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from djoser.views import UserViewSet as DjoserUserViewSet
-from rest_framework import response, status, viewsets
+from rest_framework import generics, response, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
-
-from .manage.functionality import add_and_del, out_list_ingredients
+from rest_framework.renderers import BrowsableAPIRenderer
+
+from .manage.functionality import (add_and_del, get_recipes_limit,
+                                   out_list_ingredients,
+                                   shopping_cart_etag,
+                                   shopping_cart_ingredients)
+from .async_views import AsyncReadMixin
+from .cache import (FeedCacheMixin, VersionedCacheMixin, get_version,
+                    user_flags_version)
 from .filters import IngredientFilter, RecipeFilter
 from .pagination import LimitPageNumberPagination
 from .permissions import IsAuthor
+from .renderers import (FastJSONRenderer, ShoppingListCSVRenderer,
+                        ShoppingListJSONRenderer, ShoppingListTextRenderer)
+from .replica import ReplicaReadMixin
+from .row_serializers import RecipeRowSerializer, RowListMixin
 from .serializers import (FavoriteSerializer, IngredientSerializer,
                           RecipeCreateSerializer, RecipeReadListSerializer,
                           ShoppingCartSerializer, SubscriptionSerializer,
-                          TagSerializer, UserSerializer)
-from recipe.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                           ShoppingCart, Tag)
+                          TagSerializer, TokenRefreshSerializer,
+                          UserSerializer)
+from recipe.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 from user.models import Subscription, User
 
 
-class UserViewset(DjoserUserViewSet):
+class UserViewset(ReplicaReadMixin, AsyncReadMixin, DjoserUserViewSet):
     """DjoserViewSet с управлением подпиской."""
 
+    async_actions = ('subscriptions',)
+    replica_actions = ('list',)
     queryset = User.objects.all().order_by('id')
     serializer_class = UserSerializer
     pagination_class = LimitPageNumberPagination
 
+    def get_count_cache_prefix(self):
+        if self.action != 'subscriptions':
+            return None
+        user_id = self.request.user.id
+        return f'{user_id}:{get_version(user_flags_version(user_id))}'
+
     @action(
         methods=('post', 'delete'),
         detail=True,
@@ -64,40 +88,95 @@ class UserViewset(DjoserUserViewSet):
         """Возвращает авторов на которых подисан пользователь."""
 
         return self.get_paginated_response(
-            SubscriptionSerializer(self.paginate_queryset(
-                User.objects.filter(subscription_author__user=request.user)),
+            SubscriptionSerializer(
+                self.paginate_queryset(self.get_subscriptions(request)),
                 many=True,
                 context={'request': request},
             ).data
         )
 
+    async def asubscriptions(self, request):
+        """subscriptions() для ASGI."""
+
+        page = await sync_to_async(self.paginate_queryset)(
+            self.get_subscriptions(request)
+        )
+        return self.get_paginated_response(
+            SubscriptionSerializer(
+                page, many=True, context={'request': request}
+            ).data
+        )
+
+    def get_subscriptions(self, request):
+        """Авторы из подписок с последними рецептами."""
+
+        return User.objects.filter(
+            subscription_author__user=request.user
+        ).prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=Recipe.objects.first_per_author(
+                    get_recipes_limit(request)
+                ),
+                to_attr='limited_recipes'
+            )
+        ).order_by('id')
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheMixin, ReplicaReadMixin, AsyncReadMixin,
+                 viewsets.ReadOnlyModelViewSet):
     """ViewSet информации по тегам."""
 
+    cache_model = Tag
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, ReplicaReadMixin,
+                        AsyncReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet информации по ингредиентам."""
 
+    cache_model = Ingredient
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     filter_backends = (IngredientFilter,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(FeedCacheMixin, RowListMixin, ReplicaReadMixin,
+                    AsyncReadMixin, viewsets.ModelViewSet):
     """ViewSet информации по рецепту."""
 
     queryset = Recipe.objects.all()
     serializer_class = RecipeReadListSerializer
+    row_serializer_class = RecipeRowSerializer
+    replica_actions = ('list', 'retrieve', 'download_shopping_cart')
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
     permission_classes = (IsAuthor,)
     pagination_class = LimitPageNumberPagination
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        if self.shared_feed:
+            return Recipe.objects.with_user_flags(None)
+        return Recipe.objects.with_user_flags(self.request.user)
+
+    def get_count_queryset(self):
+        """Рецепты для COUNT(*) ленты с сортировкой по рейтингу: те же
+            фильтры без JOIN с рейтингами (секунда на миллионе рецептов).
+            Строка рейтинга есть у каждого рецепта, число то же.
+        """
+
+        params = self.request.query_params
+        if params.get('ordering') not in self.score_orderings:
+            return None
+        data = params.copy()
+        del data['ordering']
+        return RecipeFilter(
+            data, queryset=Recipe.objects.all(), request=self.request
+        ).qs
+
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PUT', 'PATCH'):
             return RecipeCreateSerializer
@@ -130,15 +209,33 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(
         methods=('get',),
         detail=False,
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer,
+        ),
     )
+    @method_decorator(condition(etag_func=shopping_cart_etag))
     def download_shopping_cart(self, request):
         """Выгрузка <спика покупок>."""
 
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=self.request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).order_by('ingredient__name').annotate(amount=Sum('amount'))
-        return out_list_ingredients(self, request, ingredients)
+        ingredients = shopping_cart_ingredients(request.user)
+        return out_list_ingredients(request, ingredients)
+
+
+class TokenRefreshView(generics.GenericAPIView):
+    """Продление входа при STATELESS_AUTH: refresh-токен
+        меняется на новый access-токен.
+    """
+
+    serializer_class = TokenRefreshSerializer
+    permission_classes = (AllowAny,)
+    authentication_classes = ()
+
+    def post(self, request):
+        if not settings.STATELESS_AUTH:
+            raise Http404
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return response.Response(serializer.data)
@@ -0,0 +1,137 @@
+import os
+from functools import partial
+from threading import BoundedSemaphore, Lock
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+# Пулы процесса по алиасу и параметрам подключения
+pools = {}
+pools_lock = Lock()
+
+
+class ConnectionPool:
+    """Открытые соединения с одной базой, общие для потоков процесса.
+
+    Одновременно выдано не больше size соединений: поток, которому
+    не хватило, ждёт до timeout секунд. Возвращённое соединение без
+    ошибок остаётся открытым для следующего запроса, последним
+    вернувшееся выдаётся первым.
+    """
+
+    def __init__(self, size, timeout):
+        self.idle = []
+        self.lock = Lock()
+        self.slots = BoundedSemaphore(size)
+        self.timeout = timeout
+
+    def get(self, connect, health_check=False):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f'Все соединения пула заняты дольше {self.timeout} с'
+            )
+        try:
+            while True:
+                with self.lock:
+                    connection = self.idle.pop() if self.idle else None
+                if connection is None:
+                    return connect()
+                if not health_check or self.is_usable(connection):
+                    return connection
+                connection.close()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        try:
+            if not connection.closed and self.reset(connection):
+                with self.lock:
+                    self.idle.append(connection)
+                return
+            connection.close()
+        finally:
+            self.slots.release()
+
+    @staticmethod
+    def reset(connection):
+        """Откатывает незавершённую транзакцию и включает autocommit:
+            atomic() выключает его, и соединение, закрытое внутри
+            atomic(), иначе досталось бы следующему запросу без него.
+            False - соединение потеряно и в пул не вернётся.
+        """
+
+        try:
+            if connection.info.transaction_status in (
+                extensions.TRANSACTION_STATUS_INTRANS,
+                extensions.TRANSACTION_STATUS_INERROR,
+            ):
+                connection.rollback()
+            if connection.info.transaction_status != (
+                extensions.TRANSACTION_STATUS_IDLE
+            ):
+                return False
+            connection.autocommit = True
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def is_usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Exception:
+            return False
+        return True
+
+
+def get_pool(alias, conn_params, settings_dict):
+    """Пул соединений алиаса с параметрами conn_params. Пул по одному
+        алиасу не выдаст соединение с другой базой, если параметры
+        поменялись: например, тестовый прогон переключил NAME на
+        тестовую базу.
+    """
+
+    key = (alias, repr(sorted(conn_params.items())))
+    pool = pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                options = settings_dict.get('POOL', {})
+                pool = pools[key] = ConnectionPool(
+                    options.get('SIZE', 10), options.get('TIMEOUT', 10)
+                )
+    return pool
+
+
+# Дочерний процесс после fork не должен писать в сокеты родителя
+os.register_at_fork(after_in_child=pools.clear)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с пулом соединений процесса.
+
+    Соединение берётся из пула при первом обращении к базе и
+    возвращается в него, когда Django закрывает соединение: в конце
+    запроса, при CONN_MAX_AGE = 0. Новое соединение открывается
+    и настраивается как обычно. При CONN_HEALTH_CHECKS соединение
+    из пула перед выдачей проверяется SELECT 1.
+    """
+
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        # Соединение вернётся в тот пул, из которого взято
+        self.pool = get_pool(self.alias, conn_params, self.settings_dict)
+        return self.pool.get(
+            partial(super().get_new_connection, conn_params),
+            self.settings_dict['CONN_HEALTH_CHECKS'],
+        )
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.put(self.connection)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 
 import os
+from datetime import timedelta
 
 from django.core.management.utils import get_random_secret_key
 from dotenv import load_dotenv
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'recipe.apps.RecipeConfig',
     'api.apps.ApiConfig',
@@ -96,6 +98,14 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
 
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+# Соединений в пуле процесса (foodgram.postgresql_pool), 0 - без пула.
+# Под ASGI каждый запрос выполняется в своём потоке: постоянные
+# соединения CONN_MAX_AGE остались бы в завершённых потоках, поэтому
+# там соединения переиспользует пул
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+
 DATABASES = {
     'default': {
         'ENGINE': os.getenv('DB_ENGINE', default='django.db.backends.postgresql'),
@@ -103,10 +113,73 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        # Сколько (сек) соединение живёт между запросами, 0 - до конца
+        # запроса
+        'CONN_MAX_AGE': int(os.getenv(
+            'DB_CONN_MAX_AGE', 0 if SERVER_MODE == 'asgi' else 60
+        )),
+        # Соединение проверяется перед повторным использованием
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1',
+        'POOL': {
+            'SIZE': DB_POOL_SIZE,
+            # Сколько (сек) ждать свободного соединения
+            'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+}
+
+if DB_POOL_SIZE and (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql'
+):
+    DATABASES['default']['ENGINE'] = 'foodgram.postgresql_pool'
+    # Соединение возвращается в пул в конце каждого запроса
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Реплика для чтения (api.replica): включается DB_REPLICA_HOST или
+# DB_REPLICA_NAME, остальные параметры - как у основной базы. В тестах
+# вместо неё используется основная база
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.getenv('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replica.ReplicaRouter']
+
+# Сколько (сек) после изменяющего запроса пользователь читает из основной
+# базы: реплика должна успеть получить его изменения
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+# Cache
+# Общий для всех воркеров gunicorn: версии справочников и ответы API
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='/tmp/foodgram_cache'),
+        # На активного пользователя приходится несколько ключей (версия
+        # и флаги <избранного>, пользователь токена, привязка к основной
+        # базе) плюс общие страницы ленты и справочников. FileBasedCache
+        # перечисляет файлы при каждой записи, поэтому для тысяч
+        # активных пользователей лучше CACHE_BACKEND memcached или redis.
+        # Вытеснение влияет только на попадания: версии (api.cache)
+        # после вытеснения не повторяются
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 3000)),
+        },
     }
 }
 
+# Сколько (сек) хранить готовые ответы справочников
+API_CACHE_TIMEOUT = 60 * 60 * 24
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -147,6 +220,14 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'back-static')
 MEDIA_URL = 'back-media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'back-media')
 
+# Каталог data/ репозитория (load_ingredients): в контейнере он
+# смонтирован в /app/data, при локальном запуске лежит рядом с backend/
+DATA_DIR = os.getenv('DATA_DIR')
+if DATA_DIR is None:
+    DATA_DIR = os.path.join(BASE_DIR, 'data')
+    if not os.path.isdir(DATA_DIR):
+        DATA_DIR = os.path.join(os.path.dirname(BASE_DIR), 'data')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -161,7 +242,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.TokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -180,6 +261,7 @@ DJOSER = {
         'user': 'api.serializers.UserSerializer',
         'current_user': 'api.serializers.UserSerializer',
         'user_create': 'djoser.serializers.UserCreateSerializer',
+        'token': 'api.serializers.TokenSerializer',
     },
 }
 
@@ -201,3 +283,94 @@ CHARACTER_VALIDATOR = r'^[а-яА-ЯёЁa-zA-Z0-9]+$'
 CHARACTER_VALIDATOR_USER = r'^[a-zA-Z0-9]+$'
 
 CHARACTER_VALIDATOR_COLOR = r'^#([0-9a-fA-F]{3,6})$'
+
+# Выгрузка списка покупок ----------------------
+# ----------------------------------------------
+
+# Сколько строк читать из базы за один раз
+SHOPPING_LIST_CHUNK_SIZE = 2000
+
+
+# Поиск ингредиентов ---------------------------
+# ----------------------------------------------
+
+# Как часто (сек) воркер сверяет версию индекса ингредиентов
+INGREDIENT_INDEX_CHECK_INTERVAL = 1
+
+# Больше ингредиентов индекс в памяти воркера не строится: поиск идёт
+# запросом к базе (триграммный индекс PostgreSQL)
+INGREDIENT_INDEX_MAX_ROWS = int(os.getenv('INGREDIENT_INDEX_MAX_ROWS', 20000))
+
+
+# Пагинация ------------------------------------
+# ----------------------------------------------
+
+# Сколько (сек) хранить COUNT(*) для постраничной выдачи
+PAGINATION_COUNT_TIMEOUT = int(os.getenv('PAGINATION_COUNT_TIMEOUT', 30))
+# С какого размера таблицы без фильтров брать оценку из статистики
+APPROXIMATE_COUNT_THRESHOLD = 100_000
+
+
+# Рейтинг рецептов -----------------------------
+# ----------------------------------------------
+
+# За сколько часов вес добавления в <популярном сейчас> падает вдвое
+RECIPE_TRENDING_HALF_LIFE_HOURS = 72
+# Добавления старше этого (дней) в <популярном сейчас> не учитываются
+RECIPE_TRENDING_WINDOW_DAYS = 30
+
+
+# ASGI -----------------------------------------
+# ----------------------------------------------
+
+# Под ASGI GET-запросы ленты, справочников и подписок обслуживают
+# асинхронные обработчики (api.async_views.AsyncReadMixin)
+ASYNC_READ_VIEWS = SERVER_MODE == 'asgi'
+
+
+# Лента рецептов -------------------------------
+# ----------------------------------------------
+
+# Список рецептов собирается из строк .values() без сериализатора DRF
+# (api.row_serializers.RecipeRowSerializer), ответ тот же побайтно
+FAST_RECIPE_LIST = os.getenv('FAST_RECIPE_LIST', '1') == '1'
+
+
+# Картинки рецептов ----------------------------
+# ----------------------------------------------
+
+# Размеры: наибольшие ширина и высота, None - без уменьшения
+RECIPE_IMAGE_SIZES = {
+    'thumbnail': (320, 320),
+    'medium': (960, 960),
+    'original': None,
+}
+# WEBP или JPEG
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+RECIPE_IMAGE_QUALITY = int(os.getenv('RECIPE_IMAGE_QUALITY', 80))
+# Процессов обработки картинок в каждом воркере, 0 - обработка в запросе
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+# Секунд, которые файл без ссылок на него живёт до удаления: файл может
+# принадлежать рецепту, транзакция которого ещё не закоммичена
+MEDIA_GARBAGE_GRACE = int(os.getenv('MEDIA_GARBAGE_GRACE', 3600))
+
+
+# Аутентификация -------------------------------
+# ----------------------------------------------
+
+# Вход выдаёт подписанный access-токен JWT (в том же auth_token)
+# и refresh-токен: GET-запросы проверяют его без обращения к базе
+STATELESS_AUTH = os.getenv('STATELESS_AUTH', '0') == '1'
+
+SIMPLE_JWT = {
+    # Профиль в access-токене и его блокировка отстают не дольше этого
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('ACCESS_TOKEN_MINUTES', 15))
+    ),
+    'REFRESH_TOKEN_LIFETIME': timedelta(
+        days=int(os.getenv('REFRESH_TOKEN_DAYS', 7))
+    ),
+}
+
+# Сколько (сек) хранить пользователя, найденного по ключу authtoken
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 300))
@@ -0,0 +1,13 @@
+import os
+
+# gunicorn читает этот файл из рабочей директории сам. По умолчанию
+# приложение работает через foodgram.wsgi; SERVER_MODE=asgi запускает
+# foodgram.asgi в воркерах uvicorn (см. README).
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
@@ -1,13 +1,21 @@
 from django.contrib import admin
 
 from .models import (Ingredient, Recipe, Tag, IngredientInRecipe,
-                     Favorite, ShoppingCart)
+                     Favorite, RecipeScore, ShoppingCart,
+                     ShoppingCartTotal)
+from api.pagination import CachedCountPaginator
 
 
 class IngredientInline(admin.TabularInline):
     model = IngredientInRecipe
     extra = 2
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'ingredient', 'recipe'
+        )
 
 
 @admin.register(Recipe)
@@ -20,34 +28,42 @@ class RecipeAdmin(admin.ModelAdmin):
         'pub_date',
         'get_tags',
         'get_ingredients',
-        'count_favorites',
+        'favorites_count',
     )
-    readonly_fields = ('count_favorites',)
-    list_filter = ('name', 'tags',)
-    search_fields = (
-        'name', 'cooking_time',
-        'author__email', 'ingredient__name')
+    readonly_fields = ('favorites_count',)
+    list_filter = ('tags', 'pub_date',)
+    search_fields = ('name', 'author__email__exact',)
+    autocomplete_fields = ('author',)
     empty_value_display = '--empty--'
     inlines = (IngredientInline,)
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+    def save_formset(self, request, form, formset, change):
+        """Изменения ингредиентов переносятся в итоги <списков покупок>."""
 
-    @admin.display(description='Количество в избранных')
-    def count_favorites(self, obj):
-        """Получаем количество избранных."""
+        if formset.model is not IngredientInRecipe:
+            super().save_formset(request, form, formset, change)
+            return
+        old_amounts = ShoppingCartTotal.objects.recipe_amounts(form.instance)
+        super().save_formset(request, form, formset, change)
+        ShoppingCartTotal.objects.change_recipe(form.instance, old_amounts)
 
-        return obj.favorites.count()
+    def get_queryset(self, request):
+        """Теги и ингредиенты страницы - двумя запросами на всю страницу."""
+
+        return super().get_queryset(request).prefetch_related(
+            'tags', 'ingredient_list__ingredient'
+        )
 
     @admin.display(description='Ингредиенты')
     def get_ingredients(self, obj):
         """Получаем ингредиенты."""
 
         return '\n '.join([
-            f'{item["ingredient__name"]} - {item["amount"]}'
-            f' {item["ingredient__measurement_unit"]}.'
-            for item in obj.ingredient_list.values(
-                'ingredient__name',
-                'amount',
-                'ingredient__measurement_unit'
-            )
+            f'{item.ingredient.name} - {item.amount}'
+            f' {item.ingredient.measurement_unit}.'
+            for item in obj.ingredient_list.all()
         ])
 
     @admin.display(description='Тэги')
@@ -60,7 +76,7 @@ class RecipeAdmin(admin.ModelAdmin):
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
     search_fields = ('name',)
     ordering = ('measurement_unit',)
     empty_value_display = '--empty--'
@@ -69,14 +85,55 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
-    list_filter = ('user', 'recipe',)
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user', 'recipe',)
     empty_value_display = '--empty--'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe', )
+    search_fields = ('user__username__exact',)
+    autocomplete_fields = ('user', 'recipe',)
+    empty_value_display = '--empty--'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount',)
+    readonly_fields = ('user', 'ingredient', 'total_amount',)
     empty_value_display = '--empty--'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """Итоги меняются только вместе с <корзиной> и рецептами."""
+
+        return False
+
+
+@admin.register(RecipeScore)
+class RecipeScoreAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'popular', 'trending', 'dirty',)
+    readonly_fields = ('recipe', 'popular', 'trending', 'dirty',)
+    empty_value_display = '--empty--'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        """Рецепт без рейтинга пропал бы из ?ordering=popular|trending."""
+
+        return False
 
 
 @admin.register(Tag)
@@ -0,0 +1,71 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipe.models import ShoppingCartTotal
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает или проверяет итоги списков покупок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить итоги, ничего не меняя.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько пользователей обрабатывать за раз.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = User.objects.order_by('id').values_list('id', flat=True)
+        checked = mismatched = 0
+        batch = []
+        for user_id in user_ids.iterator(chunk_size=batch_size):
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                mismatched += self.process(batch, options['verify'])
+                checked += len(batch)
+                batch = []
+        if batch:
+            mismatched += self.process(batch, options['verify'])
+            checked += len(batch)
+
+        if options['verify'] and mismatched:
+            raise CommandError(
+                f'Итоги расходятся у {mismatched} из {checked} пользователей'
+            )
+        action = 'Проверено' if options['verify'] else 'Пересчитано'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action}: {checked} пользователей, '
+            f'расхождений: {mismatched}'
+        ))
+
+    def process(self, user_ids, verify):
+        """Сверяет итоги пачки пользователей и чинит расхождения."""
+
+        expected = ShoppingCartTotal.objects.calculate(user_ids)
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in ShoppingCartTotal.objects.filter(
+                user_id__in=user_ids
+            ).values_list('user_id', 'ingredient_id', 'total_amount')
+        }
+        broken = {
+            user_id for user_id, _ in expected.keys() ^ stored.keys()
+        } | {
+            user_id for (user_id, ingredient_id), total_amount
+            in expected.items()
+            if stored.get((user_id, ingredient_id)) != total_amount
+        }
+        if broken and not verify:
+            ShoppingCartTotal.objects.rebuild(broken, {
+                key: value for key, value in expected.items()
+                if key[0] in broken
+            })
+        return len(broken)
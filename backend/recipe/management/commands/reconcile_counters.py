@@ -0,0 +1,55 @@
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipe.models import Favorite, Recipe
+from user.models import Subscription, User
+
+# (модель, счётчик, модель для подсчёта, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'author'),
+)
+
+
+def count_of(model, field):
+    """Подзапрос: сколько строк model ссылается на запись через field."""
+
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет и чинит денормализованные счётчики.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Только проверить счётчики, ничего не меняя.',
+        )
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for model, counter, counted, field in COUNTERS:
+            broken = model.objects.alias(
+                actual=count_of(counted, field)
+            ).exclude(**{counter: F('actual')})
+            total = broken.count()
+            mismatched += total
+            if total and not options['verify']:
+                model.objects.filter(
+                    pk__in=broken.values('pk')
+                ).update(**{counter: count_of(counted, field)})
+            self.stdout.write(
+                f'{model._meta.label}.{counter}: расхождений {total}'
+            )
+        if options['verify'] and mismatched:
+            raise CommandError(f'Счётчики расходятся: {mismatched}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены'))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2 on 2026-10-18 13:00
+
+from django.db import migrations
+
+INDEXES = (
+    ('recipe_ingredient_name_trgm', 'name gin_trgm_ops'),
+    ('recipe_ingredient_upper_name_trgm', 'UPPER(name) gin_trgm_ops'),
+)
+
+
+def create_extension(apps, schema_editor):
+    """TrigramExtension без проверки базы в обратную сторону: на SQLite
+        откат падал на запросе к pg_extension.
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def drop_extension(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP EXTENSION IF EXISTS pg_trgm')
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} '
+            f'ON recipe_ingredient USING gin ({expression})'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0025_shoppingcarttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_extension, drop_extension),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 17:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_scores(apps, schema_editor):
+    """Заводит рейтинг каждому рецепту, пересчёт - refresh_recipe_scores."""
+
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeScore = apps.get_model('recipe', 'RecipeScore')
+    RecipeScore.objects.bulk_create(
+        RecipeScore(recipe_id=recipe_id)
+        for recipe_id in Recipe.objects.values_list('id', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0029_recipe_favorites_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipe.recipe', verbose_name='Рецепт')),
+                ('popular', models.FloatField(default=0, verbose_name='Популярность')),
+                ('trending', models.FloatField(default=0, verbose_name='Популярность сейчас')),
+                ('dirty', models.BooleanField(default=True, verbose_name='Требует пересчёта')),
+            ],
+            options={
+                'verbose_name': 'Рейтинг рецепта',
+                'verbose_name_plural': 'Рейтинги рецептов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-popular', '-recipe'], name='recipe_score_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-trending', '-recipe'], name='recipe_score_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(condition=models.Q(('dirty', True)), fields=['dirty'], name='recipe_score_dirty_idx'),
+        ),
+        migrations.RunPython(create_scores, migrations.RunPython.noop),
+    ]
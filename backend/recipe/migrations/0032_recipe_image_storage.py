@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 21:10
+
+from django.db import migrations, models
+import recipe.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0031_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(db_index=True, storage=recipe.storage.ContentAddressedStorage(), upload_to='recipe/', verbose_name='Картинка'),
+        ),
+    ]
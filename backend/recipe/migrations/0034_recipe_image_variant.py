@@ -0,0 +1,61 @@
+# Generated by Django 4.2 on 2026-10-18 22:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_variants(apps, schema_editor):
+    """Переносит имена файлов размеров из image_variants в таблицу.
+        В PostgreSQL - одним запросом.
+    """
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "INSERT INTO recipe_recipeimagevariant (recipe_id, size, name) "
+            "SELECT recipe.id, size.key, size.value ->> 'name' "
+            "FROM recipe_recipe recipe, "
+            "jsonb_each(recipe.image_variants -> 'sizes') size"
+        )
+        return
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeImageVariant = apps.get_model('recipe', 'RecipeImageVariant')
+    variants = []
+    for recipe_id, image_variants in Recipe.objects.values_list(
+        'id', 'image_variants'
+    ).iterator():
+        for size, variant in image_variants.get('sizes', {}).items():
+            variants.append(RecipeImageVariant(
+                recipe_id=recipe_id, size=size, name=variant['name']
+            ))
+        if len(variants) >= 10000:
+            RecipeImageVariant.objects.bulk_create(variants)
+            variants = []
+    RecipeImageVariant.objects.bulk_create(variants)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0033_recipe_name_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeImageVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(max_length=32, verbose_name='Размер')),
+                ('name', models.CharField(db_index=True, max_length=100, verbose_name='Файл')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_files', to='recipe.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'Размер картинки рецепта',
+                'verbose_name_plural': 'Размеры картинок рецептов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipeimagevariant',
+            constraint=models.UniqueConstraint(fields=('recipe', 'size'), name='unique_recipe_image_size'),
+        ),
+        migrations.RunPython(fill_variants, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,20 @@
+from collections import defaultdict
+from datetime import timedelta
+
 from django.conf import settings
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.db.transaction import atomic
+from django.dispatch import Signal
+
+from .storage import ContentAddressedStorage
+from user.models import Subscription, User
 
-from user.models import User
+# Изменения мимо post_save: UPDATE по QuerySet ингредиентов и пересчёт
+# итогов <списков покупок> (user_ids - чьи итоги изменились). По нему
+# api.cache сдвигает версии кэшей
+bulk_changed = Signal()
 
 
 class NameModel(models.Model):
@@ -50,6 +62,18 @@ class Tag(NameModel):
         return self.name
 
 
+class IngredientQuerySet(models.QuerySet):
+    """QuerySet ингредиентов."""
+
+    def update(self, **kwargs):
+        """UPDATE без post_save: об изменении сообщает bulk_changed."""
+
+        rows = super().update(**kwargs)
+        if rows:
+            bulk_changed.send(sender=self.model)
+        return rows
+
+
 class Ingredient(NameModel):
     """Модель ингредиента."""
 
@@ -58,6 +82,8 @@ class Ingredient(NameModel):
         max_length=settings.DATA_LENGTH_RECIPE,
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         ordering = ['name']
         verbose_name = 'Ингредиент'
@@ -73,6 +99,62 @@ class Ingredient(NameModel):
         return f'{self.name} {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с подготовленными связями и флагами."""
+
+    def with_related(self):
+        """Подтягивает автора, теги и ингредиенты одним набором запросов.
+            Порядок тегов и ингредиентов задан явно и не зависит
+            от плана запроса.
+        """
+
+        return self.select_related('author').prefetch_related(
+            models.Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            models.Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """Аннотирует <избранное>, <список покупок> и <подписку>."""
+
+        queryset = self.with_related()
+        if user is None or user.is_anonymous:
+            return queryset.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+                is_author_subscribed=models.Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_author_subscribed=models.Exists(Subscription.objects.filter(
+                user=user, author=models.OuterRef('author')
+            )),
+        )
+
+    def first_per_author(self, limit=None):
+        """Последние <limit> рецептов каждого автора одним запросом."""
+
+        queryset = self.annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author'),
+                order_by=(models.F('pub_date').desc(), models.F('id').desc()),
+            )
+        ).order_by('-pub_date', '-id')
+        if limit is not None:
+            queryset = queryset.filter(row_number__lte=limit)
+        return queryset
+
+
 class Recipe(NameModel):
     """Модель рецепта."""
 
@@ -86,6 +168,14 @@ class Recipe(NameModel):
     image = models.ImageField(
         'Картинка',
         upload_to='recipe/',
+        storage=ContentAddressedStorage(),
+        db_index=True,
+    )
+    image_variants = models.JSONField(
+        'Размеры картинки',
+        default=dict,
+        blank=True,
+        editable=False,
     )
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления (в минутах)',
@@ -101,16 +191,44 @@ class Recipe(NameModel):
         auto_now_add=True,
         editable=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        'Количество в избранных',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx',
+            ),
+        )
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает имя картинки из базы: после замены картинки
+            прежний файл освобождается, даже если её размеры ещё
+            не были готовы.
+        """
+
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_image = dict(zip(field_names, values)).get('image')
+        return instance
+
 
 class IngredientInRecipe(models.Model):
     """Модель ингредиента в рецепте."""
@@ -161,6 +279,11 @@ class UserAndRecipeModel(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
     )
+    pub_date = models.DateTimeField(
+        'Дата добавления',
+        auto_now_add=True,
+        editable=False,
+    )
 
     class Meta:
         abstract = True
@@ -197,3 +320,281 @@ class ShoppingCart(UserAndRecipeModel):
                 name='unique_shopping',
             ),
         )
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+    """QuerySet итогов <списка покупок> с инкрементальным пересчётом.
+        Итоги меняются только apply_deltas() и rebuild(), обе шлют
+        bulk_changed с пользователями, чьи итоги изменились.
+    """
+
+    def recipe_amounts(self, recipe):
+        """Количества ингредиентов рецепта: {ingredient_id: amount}."""
+
+        return dict(IngredientInRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'amount'))
+
+    @atomic
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет к итогам пользователей {ingredient_id: delta}.
+            Недостающие строки вставляются нулевыми с ignore_conflicts,
+            delta прибавляется UPDATE'ом: параллельное добавление той же
+            пары не падает на уникальности и не теряет своё слагаемое.
+        """
+
+        deltas = {key: value for key, value in deltas.items() if value}
+        user_ids = sorted(user_ids)
+        if not deltas or not user_ids:
+            return
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in sorted(deltas.items())
+                if delta > 0
+            ),
+            ignore_conflicts=True,
+        )
+        ingredients_by_delta = defaultdict(list)
+        for ingredient_id, delta in deltas.items():
+            ingredients_by_delta[delta].append(ingredient_id)
+        for delta, ingredient_ids in ingredients_by_delta.items():
+            self.filter(
+                user_id__in=user_ids, ingredient_id__in=ingredient_ids
+            ).update(
+                total_amount=Greatest(models.F('total_amount') + delta, 0)
+            )
+        self.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=deltas,
+            total_amount__lte=0
+        ).delete()
+        bulk_changed.send(sender=self.model, user_ids=user_ids)
+
+    def add_recipe(self, user_id, recipe, sign=1):
+        """Добавляет (sign=1) или убирает (sign=-1) рецепт из итогов."""
+
+        self.apply_deltas((user_id,), {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in self.recipe_amounts(recipe).items()
+        })
+
+    def change_recipe(self, recipe, old_amounts):
+        """Переносит изменение ингредиентов рецепта в итоги покупателей."""
+
+        new_amounts = self.recipe_amounts(recipe)
+        self.apply_deltas(
+            ShoppingCart.objects.filter(
+                recipe=recipe
+            ).values_list('user_id', flat=True),
+            {
+                ingredient_id: (new_amounts.get(ingredient_id, 0)
+                                - old_amounts.get(ingredient_id, 0))
+                for ingredient_id in old_amounts.keys() | new_amounts.keys()
+            }
+        )
+
+    def calculate(self, user_ids):
+        """Итоги, посчитанные заново: {(user_id, ingredient_id): amount}."""
+
+        return {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in IngredientInRecipe.objects.filter(
+                recipe__shopping_cart__user_id__in=user_ids
+            ).values(
+                'ingredient_id',
+                user_id=models.F('recipe__shopping_cart__user_id'),
+            ).annotate(
+                total_amount=models.Sum('amount')
+            ).order_by()
+        }
+
+    @atomic
+    def rebuild(self, user_ids, totals):
+        """Перезаписывает итоги пользователей готовыми значениями."""
+
+        self.filter(user_id__in=user_ids).delete()
+        self.bulk_create(
+            self.model(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount
+            )
+            for (user_id, ingredient_id), total_amount in totals.items()
+        )
+        bulk_changed.send(sender=self.model, user_ids=user_ids)
+
+
+class ShoppingCartTotal(models.Model):
+    """Модель итогового количества ингредиента в <списке покупок>."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='+',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='+',
+    )
+    total_amount = models.PositiveIntegerField('Кол-во', default=0)
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('user',)
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient',),
+                name='unique_user_ingredient',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.total_amount}'
+
+
+class RecipeScoreQuerySet(models.QuerySet):
+    """QuerySet рейтингов рецептов с инкрементальным пересчётом."""
+
+    def stale(self):
+        """Рейтинги, которые нужно пересчитать: изменённые и затухающие."""
+
+        return self.filter(models.Q(dirty=True) | models.Q(trending__gt=0))
+
+    def create_missing(self, batch_size=1000):
+        """Заводит рейтинг (к пересчёту) рецептам без него: сортировка
+            по рейтингу видит только рецепты со строкой RecipeScore.
+        """
+
+        return len(self.bulk_create(
+            (
+                self.model(recipe_id=recipe_id)
+                for recipe_id in Recipe.objects.filter(
+                    score__isnull=True
+                ).values_list('pk', flat=True).iterator()
+            ),
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        ))
+
+    def recalculate(self, recipe_ids, now):
+        """Пересчитывает рейтинги рецептов recipe_ids на момент now.
+
+        popular - сколько раз рецепт добавлен в <избранное> и <список
+        покупок>, считается одним UPDATE. trending - те же добавления
+        за последние RECIPE_TRENDING_WINDOW_DAYS дней, каждое с весом,
+        который уменьшается вдвое за RECIPE_TRENDING_HALF_LIFE_HOURS
+        часов; записываются только изменившиеся значения.
+        """
+
+        scores = self.filter(pk__in=recipe_ids)
+        scores.update(
+            popular=sum(
+                Coalesce(models.Subquery(
+                    model.objects.filter(
+                        recipe=models.OuterRef('pk')
+                    ).order_by().values('recipe').annotate(
+                        total=models.Count('pk')
+                    ).values('total')
+                ), 0)
+                for model in (Favorite, ShoppingCart)
+            ),
+            dirty=False,
+        )
+        trending = defaultdict(float)
+        since = now - timedelta(days=settings.RECIPE_TRENDING_WINDOW_DAYS)
+        half_life = settings.RECIPE_TRENDING_HALF_LIFE_HOURS * 3600
+        for model in (Favorite, ShoppingCart):
+            for recipe_id, added in model.objects.filter(
+                recipe_id__in=recipe_ids, pub_date__gte=since
+            ).values_list('recipe_id', 'pub_date').iterator():
+                age = max((now - added).total_seconds(), 0)
+                trending[recipe_id] += 0.5 ** (age / half_life)
+        changed = [
+            self.model(recipe_id=recipe_id, trending=trending[recipe_id])
+            for recipe_id, current in scores.values_list('pk', 'trending')
+            if current != trending[recipe_id]
+        ]
+        # CASE WHEN в bulk_update растёт квадратично: пишем короткими пачками
+        self.bulk_update(changed, ('trending',), batch_size=100)
+        return len(recipe_ids)
+
+
+class RecipeScore(models.Model):
+    """Модель предрассчитанного рейтинга рецепта."""
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    popular = models.FloatField('Популярность', default=0)
+    trending = models.FloatField('Популярность сейчас', default=0)
+    dirty = models.BooleanField('Требует пересчёта', default=True)
+
+    objects = RecipeScoreQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            models.Index(
+                fields=('-popular', '-recipe'),
+                name='recipe_score_popular_idx',
+            ),
+            models.Index(
+                fields=('-trending', '-recipe'),
+                name='recipe_score_trending_idx',
+            ),
+            models.Index(
+                fields=('dirty',),
+                condition=models.Q(dirty=True),
+                name='recipe_score_dirty_idx',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} {self.popular} {self.trending}'
+
+
+class RecipeImageVariant(models.Model):
+    """Модель файла размера картинки рецепта.
+
+    Повторяет image_variants рецепта построчно: сборщик мусора ищет
+    ссылки на файл по индексу name, а не по JSON всех рецептов.
+    """
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_files',
+        verbose_name='Рецепт',
+    )
+    size = models.CharField('Размер', max_length=32)
+    name = models.CharField('Файл', max_length=100, db_index=True)
+
+    class Meta:
+        verbose_name = 'Размер картинки рецепта'
+        verbose_name_plural = 'Размеры картинок рецептов'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'size'),
+                name='unique_recipe_image_size',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} {self.size}'
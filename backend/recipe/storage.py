@@ -0,0 +1,56 @@
+import os
+from hashlib import sha256
+from pathlib import PurePosixPath
+from tempfile import mkstemp
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла - SHA-256 его содержимого.
+
+    recipe/<ab>/<cd>/<abcd...>.jpg: одинаковые файлы хранятся один раз,
+    а файл под именем никогда не меняется, поэтому nginx отдаёт их
+    с Cache-Control: immutable. Повторное сохранение обновляет mtime:
+    сборщик мусора не трогает недавно сохранённые файлы.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def hashed_name(self, name, content):
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        path = PurePosixPath(name)
+        return str(
+            path.parent / digest[:2] / digest[2:4]
+            / f'{digest}{path.suffix.lower()}'
+        )
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        full_path = self.path(name)
+        try:
+            os.utime(full_path)
+            return name
+        except FileNotFoundError:
+            # Файла нет или сборщик мусора только что убрал его в корзину
+            pass
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            # Атомарно: одновременная запись того же файла безопасна
+            os.replace(temporary, full_path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return name
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import User, Subscription
+from api.pagination import CachedCountPaginator
 
 
 @admin.register(User)
@@ -11,28 +12,22 @@ class UserAdmin(admin.ModelAdmin):
         'email',
         'first_name',
         'last_name',
-        'count_subscribers',
-        'count_recipes',
+        'subscribers_count',
+        'recipes_count',
     )
     search_fields = ('username', 'email')
-    list_filter = ('username', 'email')
-    read_only_fields = ('count_subscribers', 'count_recipes')
+    list_filter = ('is_staff', 'is_active', 'date_joined')
+    readonly_fields = ('subscribers_count', 'recipes_count')
     empty_value_display = '--empty--'
-
-    @admin.display(description='Количество подписчиков')
-    def count_subscribers(self, obj):
-        """Получаем количество подписчиков."""
-        return obj.subscriber.count()
-
-    @admin.display(description='Количество рецептов')
-    def count_recipes(self, obj):
-        """Получаем количество подписчиков."""
-        return obj.recipes.count()
+    paginator = CachedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'author')
-    search_fields = ('user', 'author')
-    list_filter = ('user', )
+    search_fields = ('user__username__exact', 'author__username__exact')
+    autocomplete_fields = ('user', 'author')
     empty_value_display = '--empty--'
+    paginator = CachedCountPaginator
+    show_full_result_count = False
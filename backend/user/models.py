@@ -5,6 +5,9 @@ from django.db import models
 
 from .validators import username_validator
 
+# Поля пользователя, которые лента рецептов показывает у автора
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
 
 class User(AbstractUser):
     """Модель пользователя."""
@@ -53,6 +56,16 @@ class User(AbstractUser):
         blank=False,
         null=False
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta(AbstractUser.Meta):
         ordering = ['username']
@@ -62,6 +75,21 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Запоминает поля автора из базы: ленту сбрасывает только
+            их изменение.
+        """
+
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_author = instance.author_values()
+        return instance
+
+    def author_values(self):
+        """Загруженные значения AUTHOR_FIELDS, отложенные - None."""
+
+        return tuple(self.__dict__.get(field) for field in AUTHOR_FIELDS)
+
 
 class Subscription(models.Model):
     """Модель подписки."""
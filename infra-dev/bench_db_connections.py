@@ -0,0 +1,121 @@
+"""Цена соединений с PostgreSQL: CONN_MAX_AGE и пул под WSGI и ASGI.
+
+Запускает gunicorn с backend/gunicorn.conf.py в нескольких
+конфигурациях (DB_CONN_MAX_AGE, DB_POOL_SIZE) и нагружает его
+запросами GET /api/users/?limit=6&page=<случайная> без кэша ответов.
+На каждую конфигурацию и число одновременных клиентов печатается
+строка: запросов в секунду, p50 и p99 в мс, число ошибок и сколько
+новых соединений PostgreSQL открыто на запрос (pg_stat_database.sessions,
+PostgreSQL 14+).
+
+База берётся из переменных окружения DB_*, как в settings.py; в ней
+должны быть пользователи, например из generate_dataset. Нужны aiohttp и
+load_test.py из этого каталога.
+
+    python bench_db_connections.py --seconds 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import tempfile
+
+import psycopg2
+
+from load_test import load, start
+
+CONFIGS = (
+    ('wsgi', 'CONN_MAX_AGE=0', {'DB_CONN_MAX_AGE': '0', 'DB_POOL_SIZE': '0'}),
+    ('wsgi', 'CONN_MAX_AGE=60',
+     {'DB_CONN_MAX_AGE': '60', 'DB_POOL_SIZE': '0'}),
+    ('wsgi', 'pool 10', {'DB_POOL_SIZE': '10'}),
+    ('asgi', 'CONN_MAX_AGE=0', {'DB_CONN_MAX_AGE': '0', 'DB_POOL_SIZE': '0'}),
+    ('asgi', 'pool 10', {'DB_POOL_SIZE': '10'}),
+)
+NO_CACHE = 'django.core.cache.backends.dummy.DummyCache'
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv('DB_NAME', 'postgres'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'postgres'),
+        host=os.getenv('DB_HOST', 'db'),
+        port=os.getenv('DB_PORT', '5432'),
+    )
+
+
+def sessions(cursor):
+    """Сколько соединений с базой открыто с начала статистики."""
+
+    cursor.execute(
+        'SELECT pg_stat_get_db_sessions(oid) FROM pg_database '
+        'WHERE datname = current_database()'
+    )
+    return cursor.fetchone()[0]
+
+
+def users_page(pages):
+    def pick(ids):
+        return f'/api/users/?limit=6&page={random.randint(1, pages)}', None
+    return pick
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--workers', type=int,
+        default=int(os.getenv('GUNICORN_WORKERS', 3)),
+    )
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=[1, 12],
+    )
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8123)
+    options = parser.parse_args()
+
+    monitor = connect()
+    monitor.autocommit = True
+    cursor = monitor.cursor()
+    cursor.execute('SELECT COUNT(*) FROM user_user')
+    pick = users_page(max(cursor.fetchone()[0] // 6, 1))
+    location = tempfile.mkdtemp(prefix='bench_db_connections_')
+    try:
+        for mode, name, env in CONFIGS:
+            for concurrency in options.concurrency:
+                process = start(
+                    mode, NO_CACHE, location, options.workers, options.port,
+                    **env,
+                )
+                try:
+                    random.seed(0)
+                    # Прогрев: импорт модулей, первые соединения
+                    asyncio.run(load(
+                        None, options.port, concurrency, 3, pick=pick
+                    ))
+                    opened = sessions(cursor)
+                    result = asyncio.run(load(
+                        None, options.port, concurrency, options.seconds,
+                        pick=pick,
+                    ))
+                    requests = result['rps'] * options.seconds
+                    result['connections/request'] = round(
+                        (sessions(cursor) - opened) / max(requests, 1), 2
+                    )
+                finally:
+                    process.send_signal(signal.SIGTERM)
+                    process.wait()
+                print(
+                    f'{mode} {name:16} x{concurrency:<3} '
+                    f'{json.dumps(result)}', flush=True
+                )
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+        monitor.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Сериализация страницы рецептов: URL картинки без Base64ImageField.
+
+Сравнивает RecipeReadListSerializer и ShowAddedRecipeSerializer с их
+копиями, где поле image - прежний Base64ImageField (URL через
+storage.url() и build_absolute_uri() на каждую картинку). Запросы к
+базе в замер не входят: страница загружается заранее. Печатает лучшее
+время сериализации страницы в мс.
+
+База берётся из переменных окружения DB_*, как в settings.py; в ней
+должны быть рецепты, например из generate_dataset.
+
+    python bench_image_urls.py --limit 100
+"""
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from drf_extra_fields.fields import Base64ImageField  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from api.serializers import (RecipeReadListSerializer,  # noqa: E402
+                             ShowAddedRecipeSerializer)
+from recipe.models import Recipe  # noqa: E402
+
+
+class Base64RecipeReadListSerializer(RecipeReadListSerializer):
+    image = Base64ImageField(max_length=None, use_url=True)
+
+
+class Base64ShowAddedRecipeSerializer(ShowAddedRecipeSerializer):
+    image = Base64ImageField(max_length=None, use_url=True)
+
+
+SERIALIZERS = (
+    ('RecipeReadList', Base64RecipeReadListSerializer,
+     RecipeReadListSerializer),
+    ('ShowAddedRecipe', Base64ShowAddedRecipeSerializer,
+     ShowAddedRecipeSerializer),
+)
+
+
+def best(call, number, repeat, runs):
+    """Лучшее из runs прогонов, в каждом - минимум repeat x number."""
+
+    return min(
+        min(timeit.repeat(call, number=number, repeat=repeat)) / number
+        for _ in range(runs)
+    ) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--runs', type=int, default=3)
+    options = parser.parse_args()
+
+    request = Request(APIRequestFactory().get('/api/recipes/'))
+    recipes = list(Recipe.objects.with_user_flags(None)[:options.limit])
+    print(f'recipes: {len(recipes)}')
+    for name, before, after in SERIALIZERS:
+        result = [
+            best(
+                lambda: serializer(
+                    recipes, many=True, context={'request': request}
+                ).data,
+                options.number, options.repeat, options.runs,
+            )
+            for serializer in (before, after)
+        ]
+        print(f'{name:16} Base64ImageField {result[0]:.1f} ms -> '
+              f'ImageUrlField {result[1]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
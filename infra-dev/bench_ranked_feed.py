@@ -0,0 +1,114 @@
+"""Время первой страницы ленты с ?ordering=popular|trending.
+
+Прогоняет запросы через весь стек Django (django.test.Client) без кэша
+ответов: обычная лента, лента по рейтингу из RecipeScore и, для
+сравнения, ORDER BY COUNT(<избранного>) на лету. Отдельно меряет полный
+пересчёт рейтингов (refresh_recipe_scores --full) - худший случай, когда
+у каждого рецепта есть свежие добавления. Печатает медиану и p90 в мс.
+
+База берётся из переменных окружения DB_*, как в settings.py; цифры
+имеют смысл на PostgreSQL.
+
+    python bench_ranked_feed.py --prepare --recipes 20000 --favorites 200
+    python bench_ranked_feed.py --repeat 50
+"""
+import argparse
+import os
+import sys
+import time
+from io import StringIO
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Каждый запрос собирается заново, как при промахе кэша
+os.environ['CACHE_BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+os.environ.setdefault('RECIPE_IMAGE_WORKERS', '0')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.test import Client  # noqa: E402
+
+from recipe.models import Favorite, Recipe  # noqa: E402
+
+URLS = (
+    ('feed', '/api/recipes/'),
+    ('popular', '/api/recipes/?ordering=popular'),
+    ('trending', '/api/recipes/?ordering=trending'),
+)
+
+
+def timings(call, repeat):
+    call()
+    result = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        result.append((time.perf_counter() - started) * 1000)
+    result.sort()
+    return {
+        'p50': round(result[len(result) // 2], 1),
+        'p90': round(result[int(len(result) * 0.9)], 1),
+    }
+
+
+def get(client, url):
+    def call():
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+    return call
+
+
+def count_on_the_fly(limit):
+    def call():
+        list(Recipe.objects.annotate(
+            total=Count('favorites')
+        ).order_by('-total', '-id').values_list('id', flat=True)[:limit])
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--prepare', action='store_true',
+        help='Применить миграции и заполнить базу generate_dataset.',
+    )
+    parser.add_argument('--recipes', type=int, default=20000)
+    parser.add_argument(
+        '--favorites', type=float, default=20,
+        help='<Избранных> на пользователя, как в generate_dataset.',
+    )
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument(
+        '--skip-refresh', action='store_true',
+        help='Не мерить полный пересчёт рейтингов.',
+    )
+    options = parser.parse_args()
+
+    if options.prepare:
+        call_command('migrate', '--noinput', verbosity=0)
+        call_command(
+            'generate_dataset', recipes=options.recipes,
+            favorites=options.favorites, seed=1, stdout=StringIO(),
+        )
+    print(f'recipes: {Recipe.objects.count()}, '
+          f'favorites: {Favorite.objects.count()}')
+    client = Client()
+    for name, url in URLS:
+        print(f'{name:18} {timings(get(client, url), options.repeat)}')
+    print(f'{"count on the fly":18} '
+          f'{timings(count_on_the_fly(6), max(options.repeat // 10, 3))}')
+    if not options.skip_refresh:
+        started = time.perf_counter()
+        call_command('refresh_recipe_scores', '--full', stdout=StringIO())
+        print(f'{"refresh --full":18} '
+              f'{round(time.perf_counter() - started, 1)} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Лента рецептов из строк .values() против сериализатора DRF.
+
+Для страницы из --limit рецептов меряет:
+  - запросы + сериализацию + рендер: RecipeReadListSerializer с
+    JSONRenderer против RecipeRowSerializer с FastJSONRenderer;
+  - GET /api/recipes/?limit=... через весь стек Django без кэша ответов
+    с FAST_RECIPE_LIST выключенным и включённым.
+Печатает минимум из --repeat прогонов в мс и ускорение.
+
+База берётся из переменных окружения DB_*, как в settings.py; в ней
+должны быть рецепты, например из generate_dataset. Цифры имеют смысл
+на PostgreSQL.
+
+    python bench_recipe_rows.py --limit 100
+"""
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+sys.path.insert(0, str(BACKEND))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+# Каждый запрос собирается заново, как при промахе кэша
+os.environ['CACHE_BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db.models import Count  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+
+from api.renderers import FastJSONRenderer  # noqa: E402
+from api.row_serializers import RecipeRowSerializer  # noqa: E402
+from api.serializers import RecipeReadListSerializer  # noqa: E402
+from recipe.models import Recipe  # noqa: E402
+
+
+def best(call, repeat):
+    call()
+    return min(timeit.repeat(call, number=1, repeat=repeat)) * 1000
+
+
+def serializer_page(request, limit):
+    def call():
+        recipes = list(Recipe.objects.with_user_flags(None)[:limit])
+        return JSONRenderer().render(RecipeReadListSerializer(
+            recipes, many=True, context={'request': request}
+        ).data)
+    return call
+
+
+def rows_page(request, limit):
+    def call():
+        serializer = RecipeRowSerializer(context={'request': request})
+        rows = list(serializer.values(
+            Recipe.objects.with_user_flags(None)
+        )[:limit])
+        return FastJSONRenderer().render(serializer.to_representation(rows))
+    return call
+
+
+def http_page(limit, fast):
+    client = Client()
+
+    def call():
+        with override_settings(FAST_RECIPE_LIST=fast):
+            response = client.get(f'/api/recipes/?limit={limit}')
+        assert response.status_code == 200, response.status_code
+        return response.content
+    return call
+
+
+def report(name, before, after):
+    print(f'{name:30} {before:7.1f} ms -> {after:6.1f} ms '
+          f'({before / after:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=15)
+    options = parser.parse_args()
+
+    request = Request(APIRequestFactory().get('/api/recipes/'))
+    page = Recipe.objects.with_user_flags(None)[:options.limit]
+    ingredients = Recipe.objects.filter(
+        pk__in=[recipe.pk for recipe in page]
+    ).aggregate(total=Count('ingredient_list'))['total']
+    print(f'recipes: {options.limit}, ingredients: {ingredients}')
+    # Оба пути отдают одно и то же
+    assert serializer_page(request, options.limit)() == (
+        rows_page(request, options.limit)()
+    )
+    report(
+        'queries + serialise + render',
+        best(serializer_page(request, options.limit), options.repeat),
+        best(rows_page(request, options.limit), options.repeat),
+    )
+    report(
+        f'GET /api/recipes/?limit={options.limit}',
+        best(http_page(options.limit, False), options.repeat),
+        best(http_page(options.limit, True), options.repeat),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Нагрузочный тест backend под WSGI и под ASGI на одной базе.
+
+Запускает gunicorn с backend/gunicorn.conf.py (SERVER_MODE=wsgi и asgi)
+и нагружает его смесью GET-запросов: лента, рецепт, теги, ингредиент,
+подписки. Сценарии: с кэшем, без кэша и без кэша с медленными
+клиентами, которые шлют заголовки по байту. На каждый сценарий и режим
+печатается строка: запросов в секунду, p50 и p99 в мс, число ошибок.
+
+База берётся из переменных окружения DB_*, как в settings.py; цифры
+имеют смысл на PostgreSQL. Нужен aiohttp (pip install aiohttp).
+
+    python load_test.py --prepare        # пустая база: данные и токены
+    python load_test.py --seconds 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+BACKEND = Path(__file__).resolve().parent.parent / 'backend'
+HOST = '127.0.0.1'
+
+SCENARIOS = (
+    ('cache', 'django.core.cache.backends.filebased.FileBasedCache', False),
+    ('no cache', 'django.core.cache.backends.dummy.DummyCache', False),
+    ('no cache + slow', 'django.core.cache.backends.dummy.DummyCache', True),
+)
+
+# Токен на каждого пользователя и id рецептов и ингредиентов для URL
+COLLECT_IDS = '''
+import json
+from rest_framework.authtoken.models import Token
+from recipe.models import Ingredient, Recipe
+from user.models import User
+for user in User.objects.filter(auth_token__isnull=True):
+    Token.objects.create(user=user)
+print(json.dumps({
+    'tokens': list(Token.objects.values_list('key', flat=True)),
+    'recipes': list(Recipe.objects.values_list('id', flat=True)),
+    'ingredients': list(Ingredient.objects.values_list('id', flat=True)),
+}))
+'''
+
+
+def manage(*args):
+    return subprocess.run(
+        [sys.executable, 'manage.py', *args], cwd=BACKEND,
+        check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+
+
+def prepare(recipes):
+    manage('migrate', '--noinput')
+    manage('generate_dataset', '--recipes', str(recipes), '--seed', '1')
+
+
+def start(mode, cache_backend, location, workers, port, **env):
+    """gunicorn в режиме mode; env - дополнительные переменные."""
+
+    shutil.rmtree(location, ignore_errors=True)
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        CACHE_BACKEND=cache_backend,
+        CACHE_LOCATION=location,
+        GUNICORN_BIND=f'{HOST}:{port}',
+        GUNICORN_WORKERS=str(workers),
+        **env,
+    )
+    process = subprocess.Popen(
+        ['gunicorn', '--log-level', 'warning'], cwd=BACKEND, env=env
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, port)).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('gunicorn не запустился')
+
+
+def next_request(ids):
+    """Случайный запрос смеси: URL и токен (None - аноним)."""
+
+    value = random.random()
+    if value < 0.5:
+        return f'/api/recipes/?page={random.randint(1, 100)}', None
+    if value < 0.6:
+        return f'/api/recipes/{random.choice(ids["recipes"])}/', None
+    if value < 0.7:
+        return '/api/tags/', None
+    if value < 0.8:
+        return f'/api/ingredients/{random.choice(ids["ingredients"])}/', None
+    return (
+        '/api/users/subscriptions/?recipes_limit=3',
+        random.choice(ids['tokens']),
+    )
+
+
+async def slow_client(port, stop):
+    """Медленный клиент: шлёт заголовки по байту раз в 100 мс."""
+
+    request = f'GET /api/tags/ HTTP/1.1\r\nHost: {HOST}\r\n\r\n'.encode()
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+            for byte in request:
+                writer.write(bytes([byte]))
+                await writer.drain()
+                await asyncio.sleep(0.1)
+                if stop.is_set():
+                    break
+            writer.close()
+        except OSError:
+            await asyncio.sleep(0.1)
+
+
+async def load(ids, port, concurrency, seconds, slow=0,
+               pick=next_request):
+    """Нагрузка смесью pick(ids) -> (URL, токен)."""
+
+    latencies = []
+    errors = 0
+    stop = asyncio.Event()
+    end = time.monotonic() + seconds
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < end:
+                url, token = pick(ids)
+                headers = {'Authorization': f'Token {token}'} if token else {}
+                started = time.perf_counter()
+                try:
+                    async with session.get(
+                        f'http://{HOST}:{port}{url}', headers=headers
+                    ) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        slow_clients = [
+            asyncio.create_task(slow_client(port, stop)) for _ in range(slow)
+        ]
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        stop.set()
+        for task in slow_clients:
+            task.cancel()
+    latencies.sort()
+    return {
+        'rps': round(len(latencies) / seconds, 1),
+        'p50': round(latencies[len(latencies) // 2] * 1000, 1),
+        'p99': round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--prepare', action='store_true',
+        help='Применить миграции и заполнить базу generate_dataset.',
+    )
+    parser.add_argument('--recipes', type=int, default=600)
+    parser.add_argument(
+        '--workers', type=int,
+        default=int(os.getenv('GUNICORN_WORKERS', 3)),
+    )
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument(
+        '--slow', type=int, default=16,
+        help='Медленных клиентов в сценарии no cache + slow.',
+    )
+    parser.add_argument('--seconds', type=int, default=20)
+    parser.add_argument('--port', type=int, default=8123)
+    options = parser.parse_args()
+
+    if options.prepare:
+        prepare(options.recipes)
+    ids = json.loads(manage('shell', '-c', COLLECT_IDS))
+    location = tempfile.mkdtemp(prefix='load_test_cache_')
+    try:
+        for name, cache_backend, slow in SCENARIOS:
+            for mode in ('wsgi', 'asgi'):
+                process = start(
+                    mode, cache_backend, location,
+                    options.workers, options.port,
+                )
+                try:
+                    random.seed(0)
+                    # Прогрев: соединения с базой, кэш, импорт модулей
+                    asyncio.run(
+                        load(ids, options.port, options.concurrency, 3)
+                    )
+                    result = asyncio.run(load(
+                        ids, options.port, options.concurrency,
+                        options.seconds, options.slow if slow else 0,
+                    ))
+                finally:
+                    process.send_signal(signal.SIGTERM)
+                    process.wait()
+                print(f'{name:16} {mode}  {json.dumps(result)}', flush=True)
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()